@@ -1,18 +1,42 @@
-import os
+import os,sys
 
 import ChefUtil
-from RunFileUtil import RunFile
-from SwifJob import SwifJob
+import RunFileUtil
+from SwifJob import SwifJob,SwifJobTemplate
 from RcdbManager import RcdbManager
 
 _RCDB=RcdbManager()
 
+def setRcdbCache(filename,refresh=False,offline=False):
+  _RCDB.setCache(filename,refresh,offline)
+
+# load the RCDB constants for all runs at once, instead of run by run
+# during job generation:
+def prefetchRcdb(runs,threads=1):
+  _RCDB.setThreads(threads)
+  return _RCDB.prefetch(runs)
+
+# runs with unknown torus or solenoid scale:
+def getUnknownRcdbRuns(runs):
+  return [run for run in runs if _RCDB.getTorusScale(run) is None or _RCDB.getSolenoidScale(run) is None]
+
+# wrapper script for decoding and merging jobs, staged as a job input:
+_CHEFSH=os.path.normpath(os.path.dirname(os.path.realpath(__file__))+'/../scripts/chef.sh')
+
 class Job(SwifJob):
-  def __init__(self,workflow,cfg):
-    SwifJob.__init__(self,workflow)
-    self.addEnv('CCDB_CONNECTION','mysql://clas12reader@clasdb-farm.jlab.org/clas12')
-    self.addEnv('RCDB_CONNECTION','mysql://rcdb@clasdb-farm.jlab.org/rcdb')
-    self.addEnv('MALLOC_ARENA_MAX','2')
+  __slots__=('inputData','outputData','cfg')
+  # fields shared by all of a workflow's jobs of this class:
+  @classmethod
+  def createTemplate(cls,cfg):
+    template=SwifJobTemplate()
+    template.addEnv('CCDB_CONNECTION','mysql://clas12reader@clasdb-farm.jlab.org/clas12')
+    template.addEnv('RCDB_CONNECTION','mysql://rcdb@clasdb-farm.jlab.org/rcdb')
+    template.addEnv('MALLOC_ARENA_MAX','2')
+    return template
+  def __init__(self,workflow,cfg,template=None):
+    if template is None:
+      template=self.createTemplate(cfg)
+    SwifJob.__init__(self,workflow,template)
     self.inputData=[]
     self.outputData=[]
     self.cfg=cfg
@@ -20,92 +44,138 @@ class Job(SwifJob):
     basename=filename.split('/').pop()
     self.inputData.append(filename)
     self.addInput(basename,filename)
-    runno=RunFile(filename).runNumber
-    fileno=RunFile(filename).fileNumber
-    self.addTag('run','%.6d'%runno)
-    self.addTag('file','%.5d'%fileno)
+    rf=RunFileUtil.getRunFileNumber(filename)
+    self.addTag('run','%.6d'%rf['run'])
+    self.addTag('file','%.5d'%rf['file'])
   def addOutputData(self,basename,directory):
     ChefUtil.mkdir(directory)
     self.addTag('outDir',directory)
     self.outputData.append(directory+'/'+basename)
     self.addOutput(basename,directory+'/'+basename)
 
-class MergingJob(Job):
-  def __init__(self,workflow,cfg):
-    Job.__init__(self,workflow,cfg)
+# chef.sh sets its own environment:
+class ChefJob(Job):
+  __slots__=()
+  @classmethod
+  def createTemplate(cls,cfg):
+    return SwifJobTemplate()
+  def __init__(self,workflow,cfg,template=None):
+    Job.__init__(self,workflow,cfg,template)
+    self.addInput('chef.sh',_CHEFSH)
+  # with stageThreads, chef.sh copies the data inputs concurrently, from
+  # /cache for those on tape, instead of one after another here:
+  def _getCopyInputsCmd(self):
+    if self.cfg['stageThreads']>0:
+      return 'ls -l'
+    return Job._getCopyInputsCmd(self)
+  def getChefCmd(self,mode):
+    cmd='./chef.sh -c %s'%self.cfg['coatjava']
+    if self.cfg['stageThreads']>0:
+      cmd+=' -j %d'%self.cfg['stageThreads']
+      for filename in self.inputData:
+        if filename.find('/mss/')==0:
+          filename=filename.replace('/mss/','/cache/',1)
+        cmd+=' -i '+filename
+    return cmd+' '+mode
+
+class MergingJob(ChefJob):
+  __slots__=()
+  def __init__(self,workflow,cfg,template=None):
+    ChefJob.__init__(self,workflow,cfg,template)
     self.setRam('1GB')
     self.setTime(ChefUtil.getMergeTimeReq(cfg['mergeSize']))
     self.setDisk(ChefUtil.getMergeDiskReq(cfg['mergeSize']))
     self.addTag('coatjava',cfg['coatjava'])
     self.addTag('mode','merge')
+  # output (directory,basename) for merging the given files:
+  @staticmethod
+  def getOutputData(cfg,filenames):
+    rf1 = RunFileUtil.getRunFileNumber(filenames[0])
+    rf2 = RunFileUtil.getRunFileNumber(filenames[len(filenames)-1])
+    runno = rf1['run']
+    fileno1 = rf1['file']
+    fileno2 = rf2['file']
+    outBasename=cfg['mergePattern']%(runno,fileno1,fileno2)
+    outDir='%s/merged/%.6d/'%(cfg['workDir'],runno)
+    return outDir,outBasename
   def addInputData(self,filenames):
-    runno = RunFile(filenames[0]).runNumber
-    fileno1 = RunFile(filenames[0]).fileNumber
-    fileno2 = RunFile(filenames[len(filenames)-1]).fileNumber
-    outBasename=self.cfg['mergePattern']%(runno,fileno1,fileno2)
-    outDir='%s/merged/%.6d/'%(self.cfg['workDir'],runno)
+    outDir,outBasename=MergingJob.getOutputData(self.cfg,filenames)
     self.addOutputData(outBasename,outDir)
-    cmd=' set o=%s ; rm -f $o ; '%outBasename
-    cmd+='%s/bin/hipo-utils -merge -o $o'%self.cfg['coatjava']
     for ii in range(len(filenames)):
       Job.addInputData(self,filenames[ii])
-      basename=filenames[ii].split('/').pop()
-      cmd+=' '+basename
-    cmd+=' && ls $o && if (`stat -c%s $o` < 100) rm -f $o'
-    cmd+=' && %s/bin/hipo-utils -test $o'%self.cfg['coatjava']
-    cmd+=' || rm -f $o ; ls $o'
+    cmd=self.getChefCmd('merge')+' '+outBasename
+    for ii in range(len(filenames)):
+      cmd+=' '+filenames[ii].split('/').pop()
     Job.setCmd(self,cmd)
 
-class DecodingJob(Job):
-  def __init__(self,workflow,cfg):
-    Job.__init__(self,workflow,cfg)
+class DecodingJob(ChefJob):
+  __slots__=()
+  def __init__(self,workflow,cfg,template=None):
+    ChefJob.__init__(self,workflow,cfg,template)
     self.setRam('3GB')
     self.addTag('mode','decode')
     self.addTag('coatjava',cfg['coatjava'])
+  # output (directory,basename) for decoding the given file:
+  @staticmethod
+  def getOutputData(cfg,filename):
+    rf=RunFileUtil.getRunFileNumber(filename)
+    basename=cfg['singlePattern']%(rf['run'],rf['file'])
+    if cfg['workDir'] is None:
+      outDir = '%s/%.6d/'%(cfg['outDir'],rf['run'])
+    else:
+      outDir = '%s/singles/%.6d/'%(cfg['workDir'],rf['run'])
+    return outDir,basename
+  # repeatable, for decoding consecutive files of one run in one job:
   def addInputData(self,filename):
+    first=self.getTag('file')
     Job.addInputData(self,filename)
-    basename=self.cfg['singlePattern']%(int(self.getTag('run')),int(self.getTag('file')))
-    if self.cfg['workDir'] is None:
-      outDir = '%s/%.6d/'%(self.cfg['outDir'],int(self.getTag('run')))
-    else:
-      outDir = '%s/singles/%.6d/'%(self.cfg['workDir'],int(self.getTag('run')))
+    outDir,basename=DecodingJob.getOutputData(self.cfg,filename)
     Job.addOutputData(self,basename,outDir)
+    if first is not None:
+      self.addTag('file','%s-%s'%(first.split('-')[0],self.getTag('file')))
   def setCmd(self):
     s = self.cfg['solenoid']
     t = self.cfg['torus']
     if s is None: s = _RCDB.getSolenoidScale(int(self.getTag('run')))
     if t is None: t = _RCDB.getTorusScale(int(self.getTag('run')))
-    if s is None: sys.exit('[CLAS12Workflow] ERROR:  Unknown solenoid scale for '+str(runno))
-    if t is None: sys.exit('[CLAS12Workflow] ERROR:  Unknown torus scale for '+str(runno))
-    decoderOpts = '-c 2 -s %.4f -t %.4f'%(s,t)
-    cmd =' set o=%s ; set i=%s'%(os.path.basename(self.outputData[0]),os.path.basename(self.inputData[0]))
-    cmd+=' ; %s/bin/decoder %s -o $o $i'%(self.cfg['coatjava'],decoderOpts)
-    cmd+=' && ls $o && if (`stat -c%s $o` < 100) rm -f $o'
-    cmd+=' && %s/bin/hipo-utils -test $o'%self.cfg['coatjava']
-    cmd+=' || rm -f $o ; ls $o'
+    if s is None: sys.exit('[CLAS12Workflow] ERROR:  Unknown solenoid scale for '+self.getTag('run'))
+    if t is None: sys.exit('[CLAS12Workflow] ERROR:  Unknown torus scale for '+self.getTag('run'))
+    cmd =self.getChefCmd('decode')
+    cmd+=' -s %.4f -t %.4f'%(s,t)
+    for ii in range(len(self.inputData)):
+      cmd+=' %s %s'%(os.path.basename(self.outputData[ii]),os.path.basename(self.inputData[ii]))
     Job.setCmd(self,cmd)
 
 class ClaraJob(Job):
   THRD_MEM_REQ={0:0,   16:11, 24:16, 32:16}
   THRD_MEM_LIM={0:256, 16:10, 24:14, 32:14}
-  def __init__(self,workflow,cfg):
-    Job.__init__(self,workflow,cfg)
-    self.addEnv('CLARA_HOME',cfg['clara'])
-    self.addEnv('JAVA_OPTS','-Xmx%dg -Xms8g'%ClaraJob.THRD_MEM_LIM[cfg['threads']])
+  __slots__=()
+  @classmethod
+  def createTemplate(cls,cfg):
+    template=Job.createTemplate(cfg)
+    template.addEnv('CLARA_HOME',cfg['clara'])
+    template.addEnv('JAVA_OPTS','-Xmx%dg -Xms8g'%ClaraJob.THRD_MEM_LIM[cfg['threads']])
+    return template
+  def __init__(self,workflow,cfg,template=None):
+    Job.__init__(self,workflow,cfg,template)
     self.setRam(str(ClaraJob.THRD_MEM_REQ[cfg['threads']])+'GB')
     self.setCores(self.cfg['threads'])
     self.addTag('mode','recon')
-    # TODO: choose time based on #events:
+    # defaults, see ResourceModel for sizing by input bytes or events:
     self.setTime('24h')
-    # TODO: choose disk based on #events:
     self.setDisk('20GB')
     self.addInput('clara.sh',os.path.dirname(os.path.realpath(__file__))+'/../scripts/clara.sh')
     self.addInput('clara.yaml',cfg['reconYaml'])
+  # output (directory,basename) for reconstructing the given file:
+  @staticmethod
+  def getOutputData(cfg,filename):
+    basename=filename.split('/').pop()
+    outDir='%s/recon/%.6d/'%(cfg['outDir'],RunFileUtil.getRunFileNumber(filename)['run'])
+    return outDir,'rec_'+basename
   def addInputData(self,filename):
     Job.addInputData(self,filename)
-    basename=filename.split('/').pop()
-    outDir='%s/recon/%s/'%(self.cfg['outDir'],self.getTag('run'))
-    Job.addOutputData(self,'rec_'+basename,outDir)
+    outDir,basename=ClaraJob.getOutputData(self.cfg,filename)
+    Job.addOutputData(self,basename,outDir)
   def setCmd(self,hack):
     cmd = './clara.sh -t '+str(self.getCores())
     if self.cfg['claraLogDir'] is not None:
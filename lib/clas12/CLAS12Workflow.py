@@ -1,9 +1,12 @@
 import os,logging
-from SwifJob import SwifJob
+from SwifJob import SwifJob,SwifJobTemplate
 from SwifWorkflow import SwifWorkflow
-from RunFileUtil import RunFile
+import RunFileUtil
+from FileCatalog import FileCatalog
 import CLAS12Jobs
 import ChefUtil
+from ResourceModel import ResourceModel
+from EventCounter import EventCounter
 
 _LOGGER=logging.getLogger(__name__)
 
@@ -13,13 +16,108 @@ class CLAS12Workflow(SwifWorkflow):
     SwifWorkflow.__init__(self,name)
     self.cfg=cfg
     self.setPhaseSize(self.cfg['phaseSize'])
+    self.setPhaseBytes(self.cfg['phaseBytes'])
     self.setCombineRuns(self.cfg['multiRun'])
+    self.setTapeOrder(self.cfg['tapeOrder'])
+    # merges must not be split across phases:
+    if self.cfg['workDir'] is not None:
+      self.setMergeSize(self.cfg['mergeSize'])
     self.addRuns(self.cfg['runs'])
+    self.setThreads(self.cfg['findThreads'])
+    if self.cfg['catalog'] is not None:
+      self.setCatalog(FileCatalog(self.cfg['catalog']))
+    if self.cfg['append']:
+      self.loadExistingJobs()
+      self.setExcludes(self.getCoveredRunFiles())
     _LOGGER.info('Finding files from '+str(self.cfg['inputs']))
     self.findFiles(self.cfg['inputs'])
     self.logDir=None
+    self.templates={}
+    # directory listings for skipping existing outputs, and skipped
+    # outputs that will never exist and so need no deletion:
+    self.listings={}
+    self.notProduced=set()
+    # job requests from input sizes, with the estimated sizes of decoded
+    # and merged files (in original evio bytes) that don't exist yet, kept
+    # only until the job that reads them:
+    self.resources=None
+    self.estimatedBytes={}
+    if self.cfg['resources'] or self.cfg['resourceTable'] is not None or self.cfg['countEvents']:
+      self.resources=ResourceModel(self.cfg['resourceTable'])
+    # event counts of existing hipo inputs, for sizing recon jobs:
+    self.counter=None
+    if self.cfg['countEvents']:
+      hipoUtils='hipo-utils'
+      if self.cfg['coatjava'] is not None:
+        hipoUtils=self.cfg['coatjava']+'/bin/hipo-utils'
+      self.counter=EventCounter(self.cfg['eventCache'],self.cfg['countProcesses'],hipoUtils)
     self._mkdirs()
 
+  # one template per job class, shared by all its jobs:
+  def getTemplate(self,cls):
+    if cls not in self.templates:
+      if issubclass(cls,CLAS12Jobs.Job):
+        self.templates[cls]=cls.createTemplate(self.cfg)
+      else:
+        self.templates[cls]=SwifJobTemplate()
+    return self.templates[cls]
+
+  # (run,file) pairs of input files already processed by existing jobs:
+  def getCoveredRunFiles(self):
+    covered=set()
+    for job in self.existingJobs:
+      tags=job['tags']
+      if tags.get('mode') not in ['decode','recon']:
+        continue
+      try:
+        # batched decoding jobs cover a range of files:
+        files=[int(x) for x in tags['file'].split('-')]
+        for ii in range(files[0],files[-1]+1):
+          covered.add((int(tags['run']),ii))
+      except (KeyError,ValueError):
+        pass
+    _LOGGER.info('Skipping %d input files covered by existing jobs.'%len(covered))
+    return covered
+
+  # whether an output file already exists (and is at least skipMinSize),
+  # listing each directory only once:
+  def outputExists(self,directory,basename):
+    directory=os.path.normpath(directory)
+    if directory not in self.listings:
+      try:
+        self.listings[directory]=set(os.listdir(directory))
+      except OSError:
+        self.listings[directory]=set()
+    if basename not in self.listings[directory]:
+      return False
+    if self.cfg['skipMinSize']>0:
+      try:
+        return os.path.getsize(directory+'/'+basename)>=self.cfg['skipMinSize']
+      except OSError:
+        return False
+    return True
+
+  # whether a merge's output exists, either in workDir or moved to outDir:
+  def mergeExists(self,filenames):
+    outDir,basename=CLAS12Jobs.MergingJob.getOutputData(self.cfg,filenames)
+    if self.outputExists(outDir,basename):
+      return True
+    run=RunFileUtil.getRunFileNumber(filenames[0])['run']
+    return self.outputExists('%s/%.6d'%(self.cfg['outDir'],run),basename)
+
+  # consecutive files, in groups of mergeSize, as merged by merge():
+  def getMerges(self,files):
+    return [files[ii:ii+self.cfg['mergeSize']] for ii in range(0,len(files),self.cfg['mergeSize'])]
+
+  # input sizes in bytes, estimated for files from earlier phases, else
+  # from /mss stubs or the filesystem:
+  def getInputBytes(self,files):
+    sizes=dict([(x,self.estimatedBytes[x]) for x in files if x in self.estimatedBytes])
+    unknown=[x for x in files if x not in sizes]
+    if len(unknown)>0:
+      sizes.update(self.getSizes(unknown))
+    return sizes
+
   def _mkdirs(self):
     if self.cfg['logDir'] is not None:
       self.logDir = '%s/%s'%(self.cfg['logDir'],self.name)
@@ -45,47 +143,112 @@ class CLAS12Workflow(SwifWorkflow):
   #
   def reconclara(self,phase,hipoFiles):
     reconnedFiles=[]
+    events={}
+    if self.resources is not None:
+      sizes=self.getInputBytes(hipoFiles)
+      if self.counter is not None:
+        events=self.counter.count([x for x in hipoFiles if x not in self.estimatedBytes])
     for hipoFileName in hipoFiles:
-      job=CLAS12Jobs.ClaraJob(self.name,self.cfg)
+      if self.cfg['skipExisting']:
+        outDir,basename=CLAS12Jobs.ClaraJob.getOutputData(self.cfg,hipoFileName)
+        if self.outputExists(outDir,basename):
+          reconnedFiles.append(outDir+'/'+basename)
+          continue
+      job=CLAS12Jobs.ClaraJob(self.name,self.cfg,self.getTemplate(CLAS12Jobs.ClaraJob))
       job.setPhase(phase)
       job.addInputData(hipoFileName)
       job.setCmd(len(reconnedFiles))
+      if self.resources is not None:
+        self.resources.apply(job,'recon',sizes[hipoFileName],events.get(hipoFileName))
       self.addJob(job)
       reconnedFiles.extend(job.outputData)
+    for hipoFileName in hipoFiles:
+      self.estimatedBytes.pop(hipoFileName,None)
     return reconnedFiles
 
   #
   # decode:  add jobs for decoding evio files
-  # - one job per file
+  # - one job per decodeBatch consecutive files of a run
   # - return list of output hipo files
   #
   def decode(self,phase,evioFiles):
     hipoFiles=[]
+    skips=set()
+    # a merge's inputs needn't be decoded if its output already exists:
+    if self.cfg['skipExisting'] and self.cfg['workDir'] is not None:
+      for merge in self.getMerges(evioFiles):
+        if self.mergeExists(merge):
+          skips.update(merge)
+    sizes=None
+    if self.resources is not None:
+      sizes=self.getInputBytes(evioFiles)
+    batch=[]
     for evioFileName in evioFiles:
-      job=CLAS12Jobs.DecodingJob(self.name,self.cfg)
-      job.setPhase(phase)
-      job.addInputData(evioFileName)
-      job.setCmd()
-      self.addJob(job)
-      hipoFiles.extend(job.outputData)
+      outDir,basename=CLAS12Jobs.DecodingJob.getOutputData(self.cfg,evioFileName)
+      hipoFiles.append(outDir+'/'+basename)
+      if self.cfg['skipExisting']:
+        if evioFileName in skips or self.outputExists(outDir,basename):
+          if evioFileName in skips and not self.outputExists(outDir,basename):
+            self.notProduced.add(hipoFiles[-1])
+          continue
+      # a batch's file tag is a range, so it must be consecutive files of
+      # one run (not so after skips, or with tapeOrder):
+      if len(batch)>0:
+        last=RunFileUtil.getRunFileNumber(batch[-1])
+        rf=RunFileUtil.getRunFileNumber(evioFileName)
+        if len(batch)>=self.cfg['decodeBatch'] or last['run']!=rf['run'] or last['file']+1!=rf['file']:
+          self._addDecodingJob(phase,batch,sizes)
+          batch=[]
+      batch.append(evioFileName)
+    if len(batch)>0:
+      self._addDecodingJob(phase,batch,sizes)
+    # only merges read decoded files' estimates:
+    if self.resources is not None and self.cfg['workDir'] is not None:
+      for evioFileName,hipoFileName in zip(evioFiles,hipoFiles):
+        self.estimatedBytes[hipoFileName]=sizes[evioFileName]
     return hipoFiles
 
+  def _addDecodingJob(self,phase,evioFiles,sizes):
+    job=CLAS12Jobs.DecodingJob(self.name,self.cfg,self.getTemplate(CLAS12Jobs.DecodingJob))
+    job.setPhase(phase)
+    for evioFileName in evioFiles:
+      job.addInputData(evioFileName)
+    job.setCmd()
+    # files are decoded one after another:
+    if len(evioFiles)>1:
+      job.setTime('%ds'%(job.getSeconds(job.time)*len(evioFiles)))
+      job.setDisk('%dMB'%(job.getBytes(job.disk)*len(evioFiles)/1e6))
+    if self.resources is not None:
+      self.resources.apply(job,'decode',sum([sizes[x] for x in evioFiles]))
+    self.addJob(job)
+
   #
   # merge:  add jobs for merging hipo files
   # - one job per merge
   # - return list of output merged hipo files
   #
   def merge(self,phase,hipoFiles):
-    inputs,merged=[],[]
-    for ii in range(len(hipoFiles)):
-      inputs.append(hipoFiles[ii])
-      if len(inputs)>=self.cfg['mergeSize'] or ii>=len(hipoFiles)-1:
-        job=CLAS12Jobs.MergingJob(self.name,self.cfg)
+    merged=[]
+    if self.resources is not None:
+      sizes=self.getInputBytes(hipoFiles)
+    for inputs in self.getMerges(hipoFiles):
+      if self.resources is not None:
+        inputBytes=sum([sizes[x] for x in inputs])
+        for x in inputs:
+          self.estimatedBytes.pop(x,None)
+      if self.cfg['skipExisting'] and self.mergeExists(inputs):
+        outDir,basename=CLAS12Jobs.MergingJob.getOutputData(self.cfg,inputs)
+        merged.append(outDir+'/'+basename)
+      else:
+        job=CLAS12Jobs.MergingJob(self.name,self.cfg,self.getTemplate(CLAS12Jobs.MergingJob))
         job.setPhase(phase)
         job.addInputData(inputs)
+        if self.resources is not None:
+          self.resources.apply(job,'merge',inputBytes)
         merged.extend(job.outputData)
-        inputs=[]
         self.addJob(job)
+      if self.resources is not None:
+        self.estimatedBytes[merged[-1]]=inputBytes
     return merged
 
   #
@@ -94,19 +257,24 @@ class CLAS12Workflow(SwifWorkflow):
   #
   def delete(self,phase,deletes):
     files = list(deletes)
+    if len(self.notProduced)>0:
+      files = [ x for x in files if x not in self.notProduced ]
+      self.notProduced.difference_update(deletes)
     while len(files)>0:
       deletes=[]
       while len(deletes)<200 and len(files)>0:
         deletes.append(files.pop(0))
       if len(deletes)>0:
-        job=SwifJob(self.name)
+        job=SwifJob(self.name,self.getTemplate(SwifJob))
         job.setPhase(phase)
         job.setRam('1GB')
         job.setTime('%ds'%(60+3*len(deletes)))
         job.setDisk('100MB')
-        job.addTag('run','%.6d'%RunFile(deletes[0]).runNumber)
-        f1=RunFile(deletes[0]).fileNumber
-        f2=RunFile(deletes[len(deletes)-1]).fileNumber
+        rf1=RunFileUtil.getRunFileNumber(deletes[0])
+        rf2=RunFileUtil.getRunFileNumber(deletes[len(deletes)-1])
+        job.addTag('run','%.6d'%rf1['run'])
+        f1=rf1['file']
+        f2=rf2['file']
         job.addTag('file','%.5d-%.5d'%(f1,f2))
         job.addTag('mode','delete')
         cmds = [ '(sleep 0.5 ; rm -f %s)'%delete for delete in deletes ]
@@ -119,17 +287,27 @@ class CLAS12Workflow(SwifWorkflow):
   #
   def move(self,phase,moves):
     files = list(moves)
+    if self.cfg['skipExisting']:
+      files = [ x for x in files if not self.outputExists('%s/%.6d'%(self.cfg['outDir'],
+        RunFileUtil.getRunFileNumber(x)['run']),os.path.basename(x)) ]
+    if self.resources is not None:
+      sizes=self.getInputBytes(files)
+      # including those of skipped files:
+      for move in moves:
+        self.estimatedBytes.pop(move,None)
     while len(files)>0:
       moves=[]
       while len(moves)<200 and len(files)>0:
         moves.append(files.pop(0))
       if len(moves)>0:
-        job=SwifJob(self.name)
+        job=SwifJob(self.name,self.getTemplate(SwifJob))
         job.setPhase(phase)
         job.setRam('1GB')
         job.setTime('%ds'%(600+60*len(moves)))
         job.setDisk('100MB')
-        job.addTag('run','%.6d'%RunFile(moves[0]).runNumber)
+        if self.resources is not None:
+          self.resources.apply(job,'move',sum([sizes[x] for x in moves]))
+        job.addTag('run','%.6d'%RunFileUtil.getRunFileNumber(moves[0])['run'])
         job.addTag('mode','move')
         job.addTag('outDir',self.cfg['outDir'])
         outDir='%s/%.6d'%(self.cfg['outDir'],int(job.getTag('run')))
@@ -153,8 +331,9 @@ class CLAS12Workflow(SwifWorkflow):
 
     for hipoFileName in hipoFiles:
 
-      runno = RunFile(hipoFileName).runNumber
-      fileno = RunFile(hipoFileName).fileNumber
+      rf = RunFileUtil.getRunFileNumber(hipoFileName)
+      runno = rf['run']
+      fileno = rf['file']
       reconBaseName = os.path.basename(hipoFileName).replace('.hipo','.recon.hipo')
 
       nFiles = 1
@@ -15,21 +15,23 @@ class ThreePhaseDecoding(CLAS12Workflow):
   def __init__(self,name,cfg):
     CLAS12Workflow.__init__(self,name,cfg)
 
-  def generate(self):
+  def generatePhases(self):
 
-    self.jobs=[]
     phase=0
-    for evioFiles in self.getGroups():
+    for evioFiles in self.iterGroups():
 
       phase += 1
       hipoFiles = self.decode(phase,evioFiles)
+      yield phase
 
       phase += 1
       mergedFiles = self.merge(phase,hipoFiles)
+      yield phase
 
       phase += 1
       self.move(phase,mergedFiles)
       self.delete(phase,hipoFiles)
+      yield phase
 
 #
 # DecodingReconTest
@@ -46,21 +48,23 @@ class DecodingReconTest(CLAS12Workflow):
   def __init__(self,name,cfg):
     CLAS12Workflow.__init__(self,name,cfg)
 
-  def generate(self):
+  def generatePhases(self):
 
-    self.jobs=[]
     phase=0
-    for evioFiles in self.getGroups():
+    for evioFiles in self.iterGroups():
 
       phase += 1
       hipoFiles = self.decode(phase,evioFiles)
+      yield phase
 
       phase += 1
       mergedFiles = self.merge(phase,hipoFiles)
+      yield phase
 
       phase += 1
       self.recon(phase,hipoFiles)
       self.recon(phase,mergedFiles)
+      yield phase
 
 #
 # RollingDecoding
@@ -81,12 +85,12 @@ class RollingDecoding(CLAS12Workflow):
   def __init__(self,name,cfg):
     CLAS12Workflow.__init__(self,name,cfg)
 
-  def generate(self):
+  def generatePhases(self):
 
-    self.jobs=[]
     phase=0
 
-    decodeQueue=self.getGroups()
+    decodeQueue=self.iterGroups()
+    evioFiles=next(decodeQueue,None)
     mergeQueue,deleteQueue,moveQueue=[],[],[]
 
     while True:
@@ -103,11 +107,14 @@ class RollingDecoding(CLAS12Workflow):
         deleteQueue.append(hipoFiles)
         moveQueue.append(mergedFiles)
 
-      if len(decodeQueue)>0:
-        hipoFiles = self.decode(phase,decodeQueue.pop(0))
+      if evioFiles is not None:
+        hipoFiles = self.decode(phase,evioFiles)
         mergeQueue.append(hipoFiles)
+        evioFiles=next(decodeQueue,None)
 
-      if len(decodeQueue)==0 and len(mergeQueue)==0 and len(deleteQueue)==0:
+      yield phase
+
+      if evioFiles is None and len(mergeQueue)==0 and len(deleteQueue)==0:
         break
 
 #
@@ -123,31 +130,27 @@ class SinglesOnlyDecoding(CLAS12Workflow):
   def __init__(self,name,cfg):
     CLAS12Workflow.__init__(self,name,cfg)
 
-  def generate(self):
+  def generatePhases(self):
 
-    self.jobs=[]
     phase=0
 
-    for evioFiles in self.getGroups():
+    for evioFiles in self.iterGroups():
       phase += 1
       self.decode(phase,evioFiles)
+      yield phase
 
 class ClaraSingles(CLAS12Workflow):
 
   def __init__(self,name,cfg):
     CLAS12Workflow.__init__(self,name,cfg)
 
-  def generate(self):
-
-    reconfiles=[]
+  def generatePhases(self):
 
-    self.jobs=[]
     phase=0
 
-    for hipoFiles in self.getGroups():
-      reconfiles.extend(self.reconclara(phase,hipoFiles))
-
-    return reconfiles
+    for hipoFiles in self.iterGroups():
+      self.reconclara(phase,hipoFiles)
+      yield phase
 
 if __name__ == '__main__':
   import os,sys
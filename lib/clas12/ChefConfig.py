@@ -2,6 +2,10 @@ import os,sys,json,copy,logging,getpass,argparse,traceback
 import ChefUtil
 import RunFileUtil
 import CLAS12Workflows
+import CLAS12Jobs
+import RcdbManager
+import EventCounter
+from ResourceModel import ResourceModel
 
 _LOGGER=logging.getLogger(__name__)
 
@@ -31,20 +35,45 @@ CFG={
     'tag'           : None,
     'task'          : None,
     'inputs'        : [],
+    'catalog'       : None,
+    'append'        : None,
+    'findThreads'   : 1,
     'runs'          : [],
     'workDir'       : None,
     'outDir'        : None,
     'logDir'        : '/farm_out/'+getpass.getuser(),
     'phaseSize'     : 0,
+    'phaseBytes'    : 0,
     'mergeSize'     : 10,
+    'decodeBatch'   : 1,
+    'stageThreads'  : 0,
     'model'         : 2,
     'torus'         : None,
+    'rcdbCache'     : RcdbManager.DEFAULTCACHE,
+    'rcdbRefresh'   : False,
+    'rcdbOffline'   : False,
+    'rcdbThreads'   : 8,
     'solenoid'      : None,
     'multiRun'      : False,
+    'tapeOrder'     : False,
+    'skipExisting'  : False,
+    'skipMinSize'   : 0,
+    'resources'     : False,
+    'resourceTable' : None,
+    'countEvents'   : False,
+    'countProcesses': 8,
+    'eventCache'    : EventCounter.DEFAULTCACHE,
     'mergePattern'  : 'clas_%.6d.evio.%.5d-%.5d.hipo',
     'singlePattern' : 'clas_%.6d.evio.%.5d.hipo',
     'fileRegex'     : RunFileUtil.getFileRegex(),
     'submit'        : False,
+    'submitChunk'   : 0,
+    'submitShell'   : False,
+    'submitThreads' : 1,
+    'compact'       : False,
+    'gzip'          : False,
+    'profile'       : False,
+    'profileDump'   : None,
     'reconYaml'     : None,
     'trainYaml'     : None,
     'claraLogDir'   : None,
@@ -83,6 +112,8 @@ class ChefConfig:
     if self._workflow is None:
       name='%s-%s-%s'%(self.cfg['runGroup'],self.cfg['task'],self.cfg['tag'])
       name+='_R%dx%d'%(self.cfg['runs'][0],len(self.cfg['runs']))
+      if self.cfg['append'] is not None:
+        name=self.cfg['append']
       if self.cfg['model']==Models.ThreePhaseDecoding:
         self._workflow = CLAS12Workflows.ThreePhaseDecoding(name,self.cfg)
       elif self.cfg['model']==Models.RollingDecoding:
@@ -96,7 +127,20 @@ class ChefConfig:
       else:
         sys.exit('This should never happen #1.')
     if self._workflow.getFileCount()<1:
+      if self.cfg['append'] is not None:
+        sys.exit('Found no new input files for workflow '+self.cfg['append']+'.')
       sys.exit('FATAL ERROR:  found no applicable input files.  Check "inputs" and "run".')
+    # decoding jobs need magnet scales, for runs with files, unless overridden:
+    if Models.Coatjava[self.cfg['model']]:
+      if self.cfg['torus'] is None or self.cfg['solenoid'] is None:
+        if self.cfg['rcdbCache'] is not None:
+          CLAS12Jobs.setRcdbCache(self.cfg['rcdbCache'],self.cfg['rcdbRefresh'],self.cfg['rcdbOffline'])
+        runs=self._workflow.getRunList(1)
+        CLAS12Jobs.prefetchRcdb(runs,self.cfg['rcdbThreads'])
+        # report all runs at once, before generating anything:
+        unknown=CLAS12Jobs.getUnknownRcdbRuns(runs)
+        if len(unknown)>0:
+          sys.exit('FATAL ERROR:  Unknown torus/solenoid scale in RCDB for runs:  '+','.join([str(x) for x in unknown]))
     return self._workflow
 
   def getCli(self):
@@ -109,6 +153,9 @@ class ChefConfig:
     cli.add_argument('--model', help='* workflow model (0=ThreePhase, 1=Rolling, 2=SinglesOnly)', type=int, choices=CHOICES['model'],default=None)
 
     cli.add_argument('--inputs', metavar='PATH',help='* name of file containing a list of input files, or a directory to be searched recursively for input files, or a shell glob of either.  This option is repeatable.',action='append',type=str,default=[])
+    cli.add_argument('--catalog',metavar='PATH',help='input file catalog (SQLite), to avoid rescanning unchanged directories in --inputs', type=str,default=None)
+    cli.add_argument('--findThreads',metavar='#',help='number of threads for listing --inputs directories concurrently', type=int,default=None)
+    cli.add_argument('--append',metavar='NAME',help='add jobs to existing workflow NAME, for input files not already in it, continuing its job and phase numbering', type=str,default=None)
     cli.add_argument('--runs',   metavar='RUN/PATH',help='* run numbers (e.g. 4013 or 4013,4015 or 3980,4000-4999), or a file containing a list of run numbers.  This option is repeatable and not allowed in config file.', action='append', default=[], type=str)
 
     cli.add_argument('--outDir', metavar='PATH',help='* final data location', type=str,default=None)
@@ -123,13 +170,33 @@ class ChefConfig:
     cli.add_argument('--claraLogDir',metavar='PATH',help='location for clara log files', type=str,default=None)
 
     cli.add_argument('--phaseSize', metavar='#',help='number of files per phase', type=int, default=None)
+    cli.add_argument('--phaseBytes',metavar='#',help='maximum input bytes per phase (e.g. 20TB), from /mss stubs or file sizes', type=str, default=None)
     cli.add_argument('--mergeSize', metavar='#',help='number of files per merge', type=int, default=None)
+    cli.add_argument('--decodeBatch',metavar='#',help='number of consecutive files of a run per decoding job', type=int, default=None)
+    cli.add_argument('--stageThreads',metavar='#',help='copy decoding and merging job inputs to the node with # concurrent copies, starting decoding as each arrives (0=one after another, before the job starts)', type=int, default=None)
 
     cli.add_argument('--torus',    metavar='#.#',help='override RCDB torus scale',   type=float, default=None)
     cli.add_argument('--solenoid', metavar='#.#',help='override RCDB solenoid scale',type=float, default=None)
 
+    cli.add_argument('--rcdbCache',metavar='PATH',help='RCDB cache file, or None to disable (default=%s)'%RcdbManager.DEFAULTCACHE, type=str, default=None)
+    cli.add_argument('--rcdbRefresh',help='query RCDB again for runs in the cache', action='store_true', default=None)
+    cli.add_argument('--rcdbThreads',metavar='#',help='number of concurrent RCDB queries, if not one query for all runs', type=int, default=None)
+    cli.add_argument('--rcdbOffline',help='use only the RCDB cache, never the database', action='store_true', default=None)
+
     cli.add_argument('--fileRegex',metavar='REGEX',help='input filename format (for matching run and file numbers)', type=str, default=None)
 
+    cli.add_argument('--tapeOrder', help='pack phases so each reads as few tape volumes as possible, in position order, from the /mss stubs', action='store_true', default=None)
+
+    cli.add_argument('--skipExisting', help='do not generate jobs for outputs that already exist', action='store_true', default=None)
+    cli.add_argument('--skipMinSize',metavar='#',help='with --skipExisting, minimum size (e.g. 100MB) for an output to count as existing', type=str, default=None)
+
+    cli.add_argument('--resources', help='set job time, disk and RAM requests from input file sizes', action='store_true', default=None)
+    cli.add_argument('--resourceTable',metavar='PATH',help='JSON table of rates for --resources, e.g. from fit-resources.py (implies --resources)', type=str, default=None)
+
+    cli.add_argument('--countEvents', help='size recon jobs from their inputs\' event counts, from hipo-utils (implies --resources)', action='store_true', default=None)
+    cli.add_argument('--countProcesses',metavar='#',help='number of concurrent hipo-utils processes for --countEvents', type=int, default=None)
+    cli.add_argument('--eventCache',metavar='PATH',help='event count cache file, or None to disable (default=%s)'%EventCounter.DEFAULTCACHE, type=str, default=None)
+
     cli.add_argument('--multiRun', help='allow multiple runs per phase (non-merging workflow only)', action='store_true', default=None)
 
     cli.add_argument('--config',metavar='PATH',help='load config file (contents superceded by command line arguments)', type=str,default=None)
@@ -137,6 +204,14 @@ class ChefConfig:
     cli.add_argument('--show',    help='print config and exit', action='store_true', default=False)
 
     cli.add_argument('--submit', help='submit and run jobs immediately', action='store_true', default=False)
+    cli.add_argument('--submitChunk',metavar='#',help='with --submit, import at most # jobs per swif import, resuming from any previous attempt (0=all at once)', type=int, default=None)
+    cli.add_argument('--submitShell',help='with --submit, add jobs one swif add-job at a time instead of swif import', action='store_true', default=None)
+    cli.add_argument('--submitThreads',metavar='#',help='with --submitChunk or --submitShell, number of concurrent swif commands', type=int, default=None)
+    cli.add_argument('--compact',help='write non-indented JSON', action='store_true', default=None)
+    cli.add_argument('--gzip',   help='write gzipped JSON', action='store_true', default=None)
+
+    cli.add_argument('--profile',help='log wall time and call counts of generation stages', action='store_true', default=None)
+    cli.add_argument('--profileDump',metavar='PATH',help='write cProfile stats to PATH (implies --profile)', type=str, default=None)
 
     cli.add_argument('--version',action='version',version='0.2')
 
@@ -186,13 +261,35 @@ class ChefConfig:
     if self.cfg['outDir'] is None:
       self.cli.error('"outDir" must be specified.')
 
-    for xx in ['outDir','workDir','logDir']:
+    for xx in ['outDir','workDir','logDir','rcdbCache','eventCache']:
       if self.cfg[xx] is not None:
         if self.cfg[xx]=='None' or self.cfg[xx]=='NULL' or self.cfg[xx]=='null':
           self.cfg[xx]=None
         elif not self.cfg[xx].startswith('/'):
           self.cli.error('"'+xx+'" must be an absolute path, not '+self.cfg[xx])
 
+    try:
+      self.cfg['phaseBytes']=ChefUtil.getBytes(self.cfg['phaseBytes'])
+    except ValueError:
+      self.cli.error('"phaseBytes" must be an integer or e.g. 500GB, not '+str(self.cfg['phaseBytes']))
+
+    try:
+      self.cfg['skipMinSize']=ChefUtil.getBytes(self.cfg['skipMinSize'])
+    except ValueError:
+      self.cli.error('"skipMinSize" must be an integer or e.g. 100MB, not '+str(self.cfg['skipMinSize']))
+
+    if self.cfg['resourceTable'] is not None:
+      try:
+        ResourceModel(self.cfg['resourceTable'])
+      except (IOError,ValueError) as e:
+        self.cli.error('Invalid "resourceTable":  '+str(e))
+
+    if self.cfg['decodeBatch']<1:
+      self.cli.error('"decodeBatch" must be a positive integer.')
+
+    if self.cfg['stageThreads']<0:
+      self.cli.error('"stageThreads" must not be negative.')
+
     # non-merging workflows:
     if self.cfg['model']==Models.SinglesDecoding or self.cfg['model']==Models.ClaraRecon:
 
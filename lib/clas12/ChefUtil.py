@@ -15,6 +15,19 @@ def mkdir(path):
         _LOGGER.critical('Cannot make directory: '+path)
         sys.exit(1)
 
+# convert an integer or a string like 500GB to bytes:
+def getBytes(size):
+  if type(size) is int:
+    return size
+  size=str(size).strip().upper()
+  scale=1
+  for unit,xx in [('TB',1e12),('GB',1e9),('MB',1e6),('KB',1e3)]:
+    if size.endswith(unit):
+      size=size[:-len(unit)]
+      scale=int(xx)
+      break
+  return int(scale * float(size))
+
 def getMergeDiskReq(nfiles):
   return str(int(2*nfiles*0.5)+3)+'GB'
 
@@ -35,8 +48,12 @@ def getFileList(fileOrDir):
     sys.exit(1)
   return fileList
 
-def countHipoEvents(filename):
-  x=subprocess.check_output(['hipo-utils','-info',filename])
+def countHipoEvents(filename,hipoUtils='hipo-utils'):
+  try:
+    x=subprocess.check_output([hipoUtils,'-info',filename])
+  except (OSError,subprocess.CalledProcessError) as e:
+    _LOGGER.error('hipo-utils failed on %s:  %s'%(filename,str(e)))
+    return None
   for line in reversed(x.split('\n')):
     cols=line.strip().split()
     if len(cols)==3 and line.strip().find('Entries = ')==0:
@@ -0,0 +1,110 @@
+import os,json,time,atexit,logging,multiprocessing
+import ChefUtil
+
+_LOGGER=logging.getLogger(__name__)
+
+#
+# Event counts of HIPO files, from `hipo-utils -info` in a process pool,
+# with a persistent cache as JSON:
+#
+#   {"files":{"/path/file.hipo":{"size":...,"mtime":...,"events":...}, ...}}
+#
+# A cached count is only used while the file's size and mtime are
+# unchanged.  Failed counts are not cached.
+#
+DEFAULTCACHE=os.path.expanduser('~/.clas12-workflow/event-cache.json')
+
+# top-level, for pickling into pool processes:
+def _count(args):
+  filename,hipoUtils=args
+  return ChefUtil.countHipoEvents(filename,hipoUtils)
+
+class EventCounter():
+
+  def __init__(self,cache=None,processes=1,hipoUtils='hipo-utils'):
+    self.files={}
+    self.cache=None
+    self.dirty=False
+    self.processes=max(1,int(processes))
+    self.hipoUtils=hipoUtils
+    if cache is not None:
+      self.setCache(cache)
+
+  def setCache(self,filename):
+    first=self.cache is None
+    self.cache=filename
+    self.loadCache()
+    if first:
+      atexit.register(self.saveCache)
+
+  def loadCache(self):
+    if self.cache is None or not os.path.exists(self.cache):
+      return
+    try:
+      with open(self.cache,'r') as f:
+        self.files.update(json.load(f)['files'])
+    except (IOError,ValueError,KeyError):
+      _LOGGER.warning('Ignoring unreadable event cache '+self.cache)
+      return
+    _LOGGER.info('Loaded event cache with %d files from %s'%(len(self.files),self.cache))
+
+  def saveCache(self):
+    if self.cache is None or not self.dirty:
+      return
+    if not os.path.isdir(os.path.dirname(os.path.abspath(self.cache))):
+      os.makedirs(os.path.dirname(os.path.abspath(self.cache)))
+    with open(self.cache+'.tmp','w') as f:
+      f.write(json.dumps({'files':self.files},indent=2,separators=(',',': '),sort_keys=True))
+    os.rename(self.cache+'.tmp',self.cache)
+    self.dirty=False
+    _LOGGER.info('Saved event cache with %d files to %s'%(len(self.files),self.cache))
+
+  # return a dictionary of event counts (or None if unknown), keyed on
+  # filename, counting only new or modified files:
+  def count(self,filenames):
+    counts={}
+    todo=[]
+    for filename in filenames:
+      try:
+        stat=os.stat(filename)
+      except OSError:
+        _LOGGER.warning('Cannot stat '+filename)
+        counts[filename]=None
+        continue
+      key={'size':stat.st_size,'mtime':int(stat.st_mtime)}
+      cached=self.files.get(filename)
+      if cached is not None and cached['size']==key['size'] and cached['mtime']==key['mtime']:
+        counts[filename]=cached['events']
+      else:
+        todo.append((filename,key))
+    if len(todo)==0:
+      return counts
+    t=time.time()
+    args=[(filename,self.hipoUtils) for filename,key in todo]
+    if self.processes>1 and len(todo)>1:
+      pool=multiprocessing.Pool(min(self.processes,len(todo)))
+      try:
+        results=pool.map(_count,args,1)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      results=[_count(x) for x in args]
+    for (filename,key),events in zip(todo,results):
+      counts[filename]=events
+      if events is not None:
+        key['events']=events
+        self.files[filename]=key
+        self.dirty=True
+    _LOGGER.info('Counted events in %d files (%d cached) in %.1f s.'%(len(todo),len(filenames)-len(todo),time.time()-t))
+    return counts
+
+if __name__ == '__main__':
+  import sys
+  logging.basicConfig(level=logging.INFO)
+  usage = 'python EventCounter.py file.hipo [file.hipo [...]]'
+  if len(sys.argv)<2:
+    sys.exit(usage)
+  ec=EventCounter(processes=4)
+  for filename,events in sorted(ec.count(sys.argv[1:]).items()):
+    print('%s %s'%(filename,events))
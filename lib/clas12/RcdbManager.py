@@ -1,16 +1,42 @@
-import os,sys,json,logging
+import os,sys,json,atexit,logging,datetime,threading
+from multiprocessing.pool import ThreadPool
 
 _LOGGER=logging.getLogger(__name__)
 
+#
+# Persistent cache, since constants for past runs never change, as JSON:
+#
+#   {"uri":"...", "runs":{"4013":{"solenoid_scale":...}, ...}}
+#
+# Runs not in RCDB are cached too, with null values.  Runs whose queries
+# failed are not.
+#
+DEFAULTCACHE=os.path.expanduser('~/.clas12-workflow/rcdb-cache.json')
+
+_TIMEFORMAT='%Y-%m-%d %H:%M:%S'
+
 class RcdbManager():
 
   _URI='mysql://rcdb@clasdb.jlab.org/rcdb'
   _RCDBKEYS=['solenoid_scale','torus_scale','run_start_time']
 
-  def __init__(self):
+  def __init__(self,cache=None,threads=1):
 
     self.data={}
     self.uri=self._URI
+    self.cache=None
+    self.cached=set()
+    self.offline=False
+    self.refresh=False
+    self.dirty=False
+    self.seen=set()
+    self.hits=0
+    self.misses=0
+    # concurrent queries, with one connection per thread:
+    self.threads=threads
+    self.local=threading.local()
+    self.connections=[]
+    self.lock=threading.Lock()
 
     # let environment override database connection:
     if os.getenv('RCDB_CONNECTION') is not None:
@@ -23,12 +49,89 @@ class RcdbManager():
       _LOGGER.warning('Failed to load RCDB python module from $PYTHONPATH.')
       self.rcdb=None
 
-  def get(self,run):
+    if cache is not None:
+      self.setCache(cache)
 
-    # exit if we couldn't find RCDB python module:
-    if self.rcdb is None:
-      _LOGGER.error('Failed to load RCBD python module from $PYTHONPATH.')
-      sys.exit()
+  def setThreads(self,threads):
+    self.threads=max(1,int(threads))
+
+  # use the given cache file.  With refresh, query (and then overwrite)
+  # the cached runs again when used, with offline, only use the cache and
+  # never the database:
+  def setCache(self,filename,refresh=False,offline=False):
+    first=self.cache is None
+    self.cache=filename
+    self.refresh=refresh
+    self.offline=offline
+    self.loadCache()
+    if first:
+      atexit.register(self.saveCache)
+
+  def loadCache(self):
+    if self.cache is None or not os.path.exists(self.cache):
+      return
+    try:
+      with open(self.cache,'r') as f:
+        cache=json.load(f)
+    except (IOError,ValueError):
+      _LOGGER.warning('Ignoring unreadable RCDB cache '+self.cache)
+      return
+    if cache.get('uri')!=self.uri:
+      _LOGGER.warning('Ignoring RCDB cache for different database:  '+str(cache.get('uri')))
+      return
+    for run,data in cache['runs'].items():
+      if data.get('run_start_time') is not None:
+        try:
+          data['run_start_time']=datetime.datetime.strptime(data['run_start_time'],_TIMEFORMAT)
+        except ValueError:
+          pass
+      self.data[int(run)]=data
+      self.cached.add(int(run))
+    _LOGGER.info('Loaded RCDB cache with %d runs from %s'%(len(self.cached),self.cache))
+
+  def saveCache(self):
+    if self.cache is None or not self.dirty:
+      return
+    runs={}
+    for run in self.cached:
+      data=dict(self.data[run])
+      if isinstance(data.get('run_start_time'),datetime.datetime):
+        data['run_start_time']=data['run_start_time'].strftime(_TIMEFORMAT)
+      runs[str(run)]=data
+    if not os.path.isdir(os.path.dirname(os.path.abspath(self.cache))):
+      os.makedirs(os.path.dirname(os.path.abspath(self.cache)))
+    with open(self.cache+'.tmp','w') as f:
+      f.write(json.dumps({'uri':self.uri,'runs':runs},default=str,indent=2,separators=(',',': '),sort_keys=True))
+    os.rename(self.cache+'.tmp',self.cache)
+    self.dirty=False
+    _LOGGER.info('Saved RCDB cache with %d runs to %s'%(len(runs),self.cache))
+
+  # forget cached runs (default all), so they are queried again:
+  def invalidate(self,runs=None):
+    if runs is None:
+      runs=list(self.data.keys())
+    for run in runs:
+      self.data.pop(int(run),None)
+      self.cached.discard(int(run))
+    self.dirty=True
+
+  # hits and misses are counted once per run:
+  def _isCached(self,run):
+    if run not in self.seen:
+      self.seen.add(run)
+      if self.refresh:
+        self.data.pop(run,None)
+        self.cached.discard(run)
+      if run in self.data:
+        self.hits+=1
+      else:
+        self.misses+=1
+    return run in self.data
+
+  def _setUnknown(self,run):
+    self.data[run]=dict([(key,None) for key in self._RCDBKEYS])
+
+  def get(self,run):
 
     # exit if run isn't an integer:
     try:
@@ -38,33 +141,127 @@ class RcdbManager():
       sys.exit()
 
     # return it if we already cached this run:
-    if int(run) in self.data:
+    if self._isCached(int(run)):
       return self.data[int(run)]
 
-    # connect to database:
-    _LOGGER.debug('Opening connection to '+self.uri+' for run '+str(run))
+    if self.offline:
+      _LOGGER.error('Run %d is not in the RCDB cache, and running offline.'%int(run))
+      self._setUnknown(int(run))
+      return self.data[int(run)]
+
+    # exit if we couldn't find RCDB python module:
+    if self.rcdb is None:
+      _LOGGER.error('Failed to load RCBD python module from $PYTHONPATH.')
+      sys.exit()
+
+    self._fetch([int(run)])
+
+    # return the cached data for this run:
+    return self.data[int(run)]
+
+  def _connect(self):
+    _LOGGER.debug('Opening connection to '+self.uri)
+    return self.rcdb.RCDBProvider(self.uri)
+
+  def _disconnect(self,db):
     try:
-      db=self.rcdb.RCDBProvider(self.uri)
+      db.disconnect()
     except:
-      _LOGGER.critical('Failed connecting to '+self.uri)
-      sys.exit()
+      pass
+    _LOGGER.debug('Closed connection to '+self.uri)
+
+  # this thread's connection, opened on first use:
+  def _getConnection(self):
+    db=getattr(self.local,'db',None)
+    if db is None:
+      db=self._connect()
+      self.local.db=db
+      with self.lock:
+        self.connections.append(db)
+    return db
 
-    # read all variables from database for this run:
+  def _closeConnections(self):
+    for db in self.connections:
+      self._disconnect(db)
+    self.connections=[]
+    self.local=threading.local()
+
+  def _store(self,run,data):
+    self.data[run]=data
+    self.cached.add(run)
+    self.dirty=True
+
+  # read all variables from database for one run, returning the run, its
+  # data, and an error message if it failed:
+  def _query(self,run):
     try:
-      self.data[int(run)]={}
-      for key in self._RCDBKEYS:
-        self.data[int(run)][key]=None
+      db=self._getConnection()
+      data={}
       for key in self._RCDBKEYS:
-        self.data[int(run)][key]=db.get_condition(int(run),key).value
-    except:
-      _LOGGER.error('Failed to retrieve constants for run '+str(run))
+        condition=db.get_condition(run,key)
+        # missing from RCDB:
+        if condition is None:
+          data[key]=None
+        else:
+          data[key]=condition.value
+      return run,data,None
+    except Exception as e:
+      return run,None,str(e)
 
-    # close connection:
-    db.disconnect()
-    _LOGGER.debug('Closed connection to '+self.uri)
+  # query runs one by one, with up to self.threads at a time, and merge
+  # the results.  Failures are logged and returned, and are not cached:
+  def _fetch(self,runs):
+    if self.threads>1 and len(runs)>1:
+      pool=ThreadPool(min(self.threads,len(runs)))
+      try:
+        results=pool.map(self._query,runs,1)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      results=[self._query(run) for run in runs]
+    self._closeConnections()
+    failed=[]
+    for run,data,error in results:
+      if error is None:
+        self._store(run,data)
+      else:
+        self._setUnknown(run)
+        failed.append(run)
+        _LOGGER.error('Failed to retrieve constants for run %d:  %s'%(run,error))
+    return failed
 
-    # return the cached data for this run:
-    return self.data[int(run)]
+  # read all variables for many runs, with one query over their range if
+  # this RCDB version supports it, else concurrently run by run.  Returns
+  # the runs whose queries failed:
+  def prefetch(self,runs):
+    runs=sorted(set([int(run) for run in runs if not self._isCached(int(run))]))
+    if self.cache is not None:
+      _LOGGER.info('RCDB cache has %d hits and %d misses.'%(self.hits,self.misses))
+    if len(runs)==0 or self.offline or self.rcdb is None:
+      return []
+    _LOGGER.info('Prefetching RCDB constants for %d runs ...'%len(runs))
+    try:
+      db=self._connect()
+      try:
+        if hasattr(db,'select_values'):
+          wanted=set(runs)
+          rows=db.select_values(self._RCDBKEYS,run_min=runs[0],run_max=runs[-1])
+          for row in rows:
+            if int(row[0]) in wanted:
+              self._store(int(row[0]),dict(zip(self._RCDBKEYS,row[1:])))
+          # runs not in RCDB:
+          for run in runs:
+            if run not in self.data:
+              self._setUnknown(run)
+              self._store(run,self.data[run])
+      finally:
+        self._disconnect(db)
+    except:
+      _LOGGER.warning('Failed to select values for runs %d-%d, querying each run.'%(runs[0],runs[-1]))
+    failed=self._fetch([run for run in runs if run not in self.data])
+    self.saveCache()
+    return failed
 
   def __str__(self):
     return json.dumps(self.data,default=str,indent=2,separators=(',',': '))
@@ -86,4 +283,3 @@ if __name__ == '__main__':
   for run in sys.argv[1:]:
     print(r.getSolenoidScale(run))
   print (r)
-
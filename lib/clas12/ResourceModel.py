@@ -0,0 +1,155 @@
+import json,math,logging
+
+_LOGGER=logging.getLogger(__name__)
+
+#
+# Job time, disk and RAM requests from input sizes (or event counts) and a
+# table of observed rates, per job mode:
+#
+#   time = safety * (overheadSeconds + secondsPerGB * input GB)
+#            (or secondsPerEvent * events, if known, for recon)
+#   disk = diskOverheadGB + diskPerInput * input bytes
+#            (or input bytes + diskPerEvent * events, if known, for recon)
+#   ram  = ramGB
+#
+# For merge and move jobs, input bytes are those of the original evio
+# files, since their hipo files don't exist yet at generation time.
+# Missing or null entries leave the job's defaults alone.
+#
+DEFAULTTABLE={
+  'decode':{
+    'overheadSeconds' : 600,
+    'secondsPerGB'    : 900,
+    'diskPerInput'    : 1.5,
+    'diskOverheadGB'  : 0.5,
+    'ramGB'           : 3,
+  },
+  'merge':{
+    'overheadSeconds' : 600,
+    'secondsPerGB'    : 60,
+    'diskPerInput'    : 1.0,
+    'diskOverheadGB'  : 1,
+    'ramGB'           : 1,
+  },
+  'move':{
+    'overheadSeconds' : 600,
+    'secondsPerGB'    : 5,
+  },
+  'recon':{
+    'overheadSeconds' : 1800,
+    'secondsPerEvent' : 0.03,
+    'eventsPerGB'     : 100000,
+    'diskPerInput'    : 3.0,
+    'diskPerEvent'    : 20000,
+    'diskOverheadGB'  : 2,
+    'ramGB'           : None,
+  },
+  'safety'     : 2.0,
+  'minSeconds' : 600,
+  'maxSeconds' : 72*60*60,
+}
+
+_MODES=['decode','merge','move','recon']
+
+class ResourceModel:
+
+  def __init__(self,filename=None):
+    self.table=json.loads(json.dumps(DEFAULTTABLE))
+    if filename is not None:
+      self.load(filename)
+
+  # override the defaults with any entries in a JSON file:
+  def load(self,filename):
+    with open(filename,'r') as f:
+      table=json.load(f)
+    for key,val in table.items():
+      if key in _MODES:
+        if key not in self.table:
+          self.table[key]={}
+        self.table[key].update(val)
+      elif key in self.table:
+        self.table[key]=val
+      else:
+        raise ValueError('Invalid resource table key in %s:  %s'%(filename,key))
+    _LOGGER.info('Loaded resource table from '+filename)
+
+  def save(self,filename):
+    with open(filename,'w') as f:
+      f.write(json.dumps(self.table,indent=2,separators=(',',': '),sort_keys=True))
+
+  def _get(self,mode,key):
+    return self.table.get(mode,{}).get(key)
+
+  def getSeconds(self,mode,inputBytes,events=None):
+    overhead=self._get(mode,'overheadSeconds') or 0
+    if events is None and self._get(mode,'eventsPerGB') is not None:
+      events=inputBytes/1e9*self._get(mode,'eventsPerGB')
+    if events is not None and self._get(mode,'secondsPerEvent') is not None:
+      seconds=overhead+events*self._get(mode,'secondsPerEvent')
+    elif self._get(mode,'secondsPerGB') is not None:
+      seconds=overhead+inputBytes/1e9*self._get(mode,'secondsPerGB')
+    else:
+      return None
+    seconds*=self.table['safety']
+    return int(min(self.table['maxSeconds'],max(self.table['minSeconds'],seconds)))
+
+  def getDiskBytes(self,mode,inputBytes,events=None):
+    overhead=(self._get(mode,'diskOverheadGB') or 0)*1e9
+    if events is not None and self._get(mode,'diskPerEvent') is not None:
+      return int(inputBytes+events*self._get(mode,'diskPerEvent')+overhead)
+    if self._get(mode,'diskPerInput') is None:
+      return None
+    return int(inputBytes*self._get(mode,'diskPerInput')+overhead)
+
+  def getRamBytes(self,mode):
+    if self._get(mode,'ramGB') is None:
+      return None
+    return int(self._get(mode,'ramGB')*1e9)
+
+  # set a job's requests, rounded up to whole MB:
+  def apply(self,job,mode,inputBytes,events=None):
+    seconds=self.getSeconds(mode,inputBytes,events)
+    if seconds is not None:
+      job.setTime('%ds'%seconds)
+    disk=self.getDiskBytes(mode,inputBytes,events)
+    if disk is not None:
+      job.setDisk('%dMB'%int(math.ceil(disk/1e6)))
+    ram=self.getRamBytes(mode)
+    if ram is not None:
+      job.setRam('%dMB'%int(math.ceil(ram/1e6)))
+
+  # recon rate from CLARA logs' average (wall) processing time per event,
+  # in ms, at the 90th percentile:
+  def fitRecon(self,claraLogs):
+    rates=sorted([x.t2/1000 for x in claraLogs if x.isComplete()])
+    if len(rates)==0:
+      _LOGGER.warning('Found no complete CLARA logs for fitting.')
+      return
+    self.table['recon']['secondsPerEvent']=getPercentile(rates,0.9)
+    _LOGGER.info('Fitted recon secondsPerEvent=%.4f from %d logs'%(self.table['recon']['secondsPerEvent'],len(rates)))
+
+  # RAM from SLURM history, given a mapping of job names to modes (e.g.
+  # from a workflow manifest), with the same safety factor as time:
+  def fitRam(self,slurmStatuses,modes):
+    used={}
+    for status in slurmStatuses:
+      name=status.data.get('name')
+      if name not in modes or modes[name] not in _MODES:
+        continue
+      if not isinstance(status.data.get('memoryUsed'),float):
+        continue
+      used.setdefault(modes[name],[]).append(status.data['memoryUsed'])
+    for mode,values in used.items():
+      ram=getPercentile(sorted(values),0.9)*self.table['safety']
+      self.table[mode]['ramGB']=math.ceil(ram/1e8)/10
+      _LOGGER.info('Fitted %s ramGB=%.1f from %d jobs'%(mode,self.table[mode]['ramGB'],len(values)))
+
+def getPercentile(values,fraction):
+  return values[min(len(values)-1,int(fraction*len(values)))]
+
+if __name__ == '__main__':
+  import sys
+  rm=ResourceModel(sys.argv[1] if len(sys.argv)>1 else None)
+  for mode in _MODES:
+    print('%-7s 2GB:  %s s, %s bytes disk, %s bytes ram'%(mode,
+      rm.getSeconds(mode,2e9),rm.getDiskBytes(mode,2e9),rm.getRamBytes(mode)))
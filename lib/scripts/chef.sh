@@ -0,0 +1,129 @@
+#!/bin/bash
+
+# Wrapper for CLAS12 decoding and merging jobs, staged as a job input so
+# that each job's command only needs its arguments.
+
+version=3
+
+export CCDB_CONNECTION=mysql://clas12reader@clasdb-farm.jlab.org/clas12
+export RCDB_CONNECTION=mysql://rcdb@clasdb-farm.jlab.org/rcdb
+export MALLOC_ARENA_MAX=2
+
+usage() {
+    echo "usage: chef.sh -c coatjava [-j threads -i source [-i source [...]]] decode -s solenoid -t torus output input [output input [...]]"
+    echo "       chef.sh -c coatjava [-j threads -i source [-i source [...]]] merge output input [input [...]]"
+    echo "  -i copies a source (e.g. in /cache) to the working directory, with -j copies at a time"
+    exit 1
+}
+
+coatjava=
+threads=1
+sources=()
+while getopts "c:j:i:" OPTION; do
+    case $OPTION in
+        c)  coatjava=$OPTARG ;;
+        j)  threads=$OPTARG ;;
+        i)  sources+=($OPTARG) ;;
+        ?)  usage ;;
+    esac
+done
+shift $((OPTIND-1))
+[ -z "$coatjava" ] && usage
+[ $# -lt 1 ] && usage
+mode=$1
+shift
+
+echo "chef.sh:INFO  version $version, mode $mode"
+
+# copy one source to the working directory, verifying its size, and
+# leaving a .failed marker instead if that fails:
+copy() {
+    local s=$1 d=$(basename $1)
+    if /bin/dd bs=1M if=$s of=$d.part 2> /dev/null && [ $(stat -c%s $s) -eq $(stat -c%s $d.part) ]; then
+        mv -f $d.part $d
+    else
+        echo "chef.sh:ERROR  Failed copying $s" 1>&2
+        rm -f $d.part
+        touch $d.failed
+    fi
+}
+export -f copy
+
+# copy all sources in the background, in order, so inputs can be used
+# as soon as each arrives:
+stagein() {
+    local t0=$(date +%s.%N)
+    printf '%s\n' "${sources[@]}" | xargs -P $threads -n 1 bash -c 'copy $0'
+    local t1=$(date +%s.%N) bytes=$(du -bc $(printf '%s\n' "${sources[@]}" | xargs -n 1 basename) 2> /dev/null | tail -1 | cut -f1)
+    echo "chef.sh:INFO  staged ${#sources[@]} inputs, $bytes bytes" \
+        $(awk "BEGIN{printf \"in %.1f s, %.1f MB/s\",$t1-$t0,$bytes/1e6/($t1-$t0+1e-9)}")
+}
+
+# wait for an input, if it's being staged:
+staged=" "
+for s in "${sources[@]}"; do staged+="$(basename $s) "; done
+waitfor() {
+    if [[ "$staged" == *" $1 "* ]]; then
+        while [ ! -e $1 ] && [ ! -e $1.failed ]; do sleep 1; done
+    fi
+    [ -e $1 ]
+}
+
+# swif has already put each input here, so remove them first, else
+# waitfor would find them before their copies are done:
+if [ ${#sources[@]} -gt 0 ]; then
+    for s in "${sources[@]}"; do
+        rm -f $(basename $s) $(basename $s).part $(basename $s).failed
+    done
+    stagein &
+fi
+
+# check existence, size, and hipo-utils -test:
+hipocheck() {
+    ( [ -e $1 ] && [ $(stat -c%s $1) -ge 100 ] && $coatjava/bin/hipo-utils -test $1 ) \
+        || \
+    ( echo "chef.sh:ERROR  Corrupt File: $1" 1>&2 && false )
+}
+
+decode() {
+    local solenoid torus OPTIND OPTION
+    while getopts "s:t:" OPTION; do
+        case $OPTION in
+            s)  solenoid=$OPTARG ;;
+            t)  torus=$OPTARG ;;
+            ?)  usage ;;
+        esac
+    done
+    shift $((OPTIND-1))
+    [ -z "$solenoid" ] || [ -z "$torus" ] || [ $# -lt 2 ] || [ $(($# % 2)) -ne 0 ] && usage
+    # one output per input, decoded in order, failing if any is missing:
+    local o i outputs=()
+    while [ $# -gt 0 ]; do
+        o=$1 i=$2
+        shift 2
+        waitfor $i && $coatjava/bin/decoder -c 2 -s $solenoid -t $torus -o $o $i && hipocheck $o || rm -f $o
+        outputs+=($o)
+    done
+    ls ${outputs[@]}
+}
+
+merge() {
+    [ $# -lt 2 ] && usage
+    local o=$1
+    shift
+    rm -f $o
+    for i in "$@"; do
+        waitfor $i || return 1
+    done
+    $coatjava/bin/hipo-utils -merge -o $o "$@" && hipocheck $o || rm -f $o
+    ls $o
+}
+
+case $mode in
+    decode) decode "$@" ;;
+    merge)  merge "$@" ;;
+    *)      usage ;;
+esac
+status=$?
+wait
+exit $status
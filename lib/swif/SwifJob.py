@@ -1,16 +1,15 @@
-import sys,json,logging,collections
+import sys,json,pipes,logging,collections
 
-class SwifJob:
-
-  __JSONFORMAT={'indent':2,'separators':(',',': ')}
-  #__JSONFORMAT={}
+#
+# Workflow-level fields shared by many jobs, held once instead of per job.
+# Jobs created from the same template share its environment (and its
+# rendered setenv command), until a job changes its environment.
+#
+class SwifJobTemplate:
 
   # defaults are for decoding a 2 GB evio file
-  def __init__(self,workflow):
+  def __init__(self):
     self.env={}
-    self.number=-1
-    self.workflow=workflow
-    self.phase=0
     self.project='clas12'
     self.track='reconstruction'
     self.cores=1
@@ -19,13 +18,60 @@ class SwifJob:
     self.ram='1GB'
     # this is no longer honored but defaults to login shell (bah, bad!):
     self.shell='/bin/tcsh'
-    self.tags=collections.OrderedDict()
+    self.envCmd=None
+
+  def addEnv(self,key,val):
+    self.env[key]=val
+    self.envCmd=None
+
+  def getEnvCmd(self):
+    if self.envCmd is None:
+      self.envCmd=getEnvCmd(self.env)
+    return self.envCmd
+
+def getEnvCmd(env):
+  cmd='unalias -a ; '
+  for xx in env.keys():
+    cmd+='setenv '+xx+' "'+env[xx]+'" ; '
+  return cmd
+
+class SwifJob(object):
+
+  __JSONFORMAT={'indent':2,'separators':(',',': ')}
+  __JSONFORMATCOMPACT={'separators':(',',':')}
+
+  __slots__=('template','env','number','workflow','phase','project','track',
+      'cores','time','disk','ram','shell','tags','inputs','outputs','logDir','cmd')
+
+  def __init__(self,workflow,template=None):
+    if template is None:
+      template=SwifJobTemplate()
+    self.template=template
+    self.env=template.env
+    self.number=-1
+    self.workflow=workflow
+    self.phase=0
+    self.project=template.project
+    self.track=template.track
+    self.cores=template.cores
+    self.time=template.time
+    self.disk=template.disk
+    self.ram=template.ram
+    self.shell=template.shell
+    # ordered (key,val) pairs, lighter than an OrderedDict:
+    self.tags=[]
+    # (local,remote) pairs:
     self.inputs=[]
     self.outputs=[]
     self.logDir=None
     self.cmd=''
 
   def addEnv(self,key,val):
+    if self.env.get(key)==val:
+      return
+    # copy on write, if it's still the template's:
+    if self.env is self.template.env:
+      self.env=dict(self.env)
     self.env[key]=val
 
   def setTrack(self,track):
@@ -41,12 +87,20 @@ class SwifJob:
     self.number=number
 
   def addTag(self,key,val):
-    self.tags[key]=val
+    for ii in range(len(self.tags)):
+      if self.tags[ii][0]==key:
+        self.tags[ii]=(key,val)
+        return
+    self.tags.append((key,val))
 
   def getTag(self,key):
-    if key in self.tags: return self.tags[key]
+    for xx in self.tags:
+      if xx[0]==key: return xx[1]
     return None
 
+  def getTags(self):
+    return collections.OrderedDict(self.tags)
+
   def setPhase(self,phase):
     if not phase is None and not type(phase) is int:
       raise ValueError('phase must be None or an integer.')
@@ -76,7 +130,7 @@ class SwifJob:
         remote='mss:'+remote
       else:
         remote='file:'+remote
-    io.append({'local':local,'remote':remote})
+    io.append((local,remote))
 
   def addInput(self,local,remote):
     self._addIO(self.inputs,local,remote)
@@ -107,7 +161,7 @@ class SwifJob:
 
   def getLogPrefix(self):
     prefix='%s/%s_p%d'%(self.logDir,self.getJobName(),self.phase)
-    for key,val in self.tags.iteritems():
+    for key,val in self.tags:
       if key=='mode':
         prefix+='_'+val
       elif key=='run':
@@ -124,43 +178,48 @@ class SwifJob:
 
   def _getCopyInputsCmd(self):
     cmd='ls -l'
-    for item in self.inputs:
-      if item['remote'].find('mss:/mss')==0:
-        remote = item['remote'].replace('mss:/mss','/cache')
-        cmd += ' && rm -f %s'%item['local']
-        cmd += ' && /bin/dd bs=1M if=%s of=%s'%(remote,item['local'])
+    for local,remote in self.inputs:
+      if remote.find('mss:/mss')==0:
+        remote = remote.replace('mss:/mss','/cache')
+        cmd += ' && rm -f %s'%local
+        cmd += ' && /bin/dd bs=1M if=%s of=%s'%(remote,local)
     return cmd
 
   def _createCommand(self):
-    cmd='unalias -a ; '
-    for xx in self.env.keys():
-      cmd+='setenv '+xx+' "'+self.env[xx]+'" ; '
+    if self.env is self.template.env:
+      cmd=self.template.getEnvCmd()
+    else:
+      cmd=getEnvCmd(self.env)
     cmd+=self._getCopyInputsCmd()
     cmd+=' && '+self.cmd
     return cmd
 
-  def getShell(self):
+  # swif add-job arguments, for running without a shell:
+  def getShellArgs(self):
 
-    job=('swif add-job -create -workflow '+self.workflow+' -slurm '
-      '-project '+self.project+' -track '+self.track+' '
-      '-time '+self.time+' -cores '+str(self.cores)+' '
-      '-disk '+self.disk+' -ram '+self.ram+' -shell '+self.shell)
+    args=['swif','add-job','-create','-workflow',self.workflow,'-name',self.getJobName(),'-slurm',
+      '-project',self.project,'-track',self.track,
+      '-time',self.time,'-cores',str(self.cores),
+      '-disk',self.disk,'-ram',self.ram,'-shell',self.shell]
 
-    if not self.phase is None: job += ' -phase '+str(self.phase)
+    if not self.phase is None: args.extend(['-phase',str(self.phase)])
 
-    for key,val in self.tags.iteritems(): job += ' -tag %s %s'   %(key,val)
-    for xx in self.inputs:  job += ' -input %s %s' %(xx['local'],xx['remote'])
-    for xx in self.outputs: job += ' -output %s %s'%(xx['local'],xx['remote'])
+    for key,val in self.tags:         args.extend(['-tag',key,val])
+    for local,remote in self.inputs:  args.extend(['-input',local,remote])
+    for local,remote in self.outputs: args.extend(['-output',local,remote])
 
     if self.logDir is not None:
-      job += ' -stdout file:'+self.getLogPrefix()+'.out'
-      job += ' -stderr file:'+self.getLogPrefix()+'.err'
+      args.extend(['-stdout','file:'+self.getLogPrefix()+'.out'])
+      args.extend(['-stderr','file:'+self.getLogPrefix()+'.err'])
 
-    job += ' \''+self._createCommand()+'\''
+    args.append(self._createCommand())
 
-    return job
+    return args
 
-  def getJson(self):
+  def getShell(self):
+    return ' '.join([pipes.quote(x) for x in self.getShellArgs()])
+
+  def getJsonData(self):
     jsonData = collections.OrderedDict()
     jsonData['name']=self.getJobName()
     jsonData['phase']=self.phase
@@ -171,16 +230,21 @@ class SwifJob:
     jsonData['diskBytes']=self.getBytes(self.disk)
     jsonData['ramBytes']=self.getBytes(self.ram)
     jsonData['timeSecs']=self.getSeconds(self.time)
-    jsonData['tags']=self.tags
+    jsonData['tags']=self.getTags()
     jsonData['command']=self._createCommand()
     if len(self.inputs)>0:
-      jsonData['input']=self.inputs
+      jsonData['input']=[{'local':local,'remote':remote} for local,remote in self.inputs]
     if len(self.outputs)>0:
-      jsonData['output']=self.outputs
+      jsonData['output']=[{'local':local,'remote':remote} for local,remote in self.outputs]
     if self.logDir is not None:
       jsonData['stdout']='file:'+self.getLogPrefix()+'.out'
       jsonData['stderr']='file:'+self.getLogPrefix()+'.err'
-    return json.dumps(jsonData,**SwifJob.__JSONFORMAT)
+    return jsonData
+
+  def getJson(self,compact=False):
+    if compact:
+      return json.dumps(self.getJsonData(),**SwifJob.__JSONFORMATCOMPACT)
+    return json.dumps(self.getJsonData(),**SwifJob.__JSONFORMAT)
 
 if __name__ == '__main__':
   job=SwifJob('foobar')
@@ -1,6 +1,10 @@
-import tempfile,subprocess
+import os,json,time,gzip,itertools,shutil,tempfile,subprocess,StringIO,logging,threading,collections
+from multiprocessing.pool import ThreadPool
 from RunFileUtil import RunFileGroups
 from SwifJob import SwifJob
+from SwifStatus import SwifStatus
+
+_LOGGER=logging.getLogger(__name__)
 
 class SwifWorkflow(RunFileGroups):
 
@@ -9,16 +13,105 @@ class SwifWorkflow(RunFileGroups):
     self.setPhaseSize(1000)
     self.name=name
     self.jobs=[]
+    self.jobCount=0
+    # when appending, jobs already in the workflow, and the last job and
+    # phase numbers to continue from:
+    self.existingJobs=[]
+    self.jobOffset=0
+    self.phaseOffset=0
 
   def addJob(self,job):
     if not isinstance(job,SwifJob):
       raise TypeError('Must be a SwifJob')
-    job.setNumber(len(self.jobs)+1)
+    self.jobCount+=1
+    job.setNumber(self.jobOffset+self.jobCount)
+    if self.phaseOffset>0 and job.phase is not None:
+      job.setPhase(job.phase+self.phaseOffset)
     self.jobs.append(job)
 
+  def getJobCount(self):
+    return self.jobCount
+
+  # subclasses add jobs with addJob and yield after each phase:
+  def generatePhases(self):
+    raise NotImplementedError('Must be implemented by subclass')
+
+  # generate all jobs into self.jobs:
+  def generate(self):
+    self.jobs=[]
+    self.jobCount=0
+    for phase in self.generatePhases():
+      pass
+
+  # generate jobs lazily, keeping only one phase in self.jobs at a time:
+  def iterJobs(self):
+    self.jobs=[]
+    self.jobCount=0
+    for phase in self.generatePhases():
+      jobs,self.jobs=self.jobs,[]
+      for job in jobs:
+        yield job
+
+  def getManifestFilename(self):
+    return self.name+'.manifest.json'
+
+  # name, phase, and tags of all jobs, those existing and those in the
+  # given workflow JSON file, read one at a time, and the run directories'
+  # mtimes.  Call this only once the file's jobs are in swif, since jobs
+  # and directories in the manifest are skipped when appending:
+  def saveManifest(self,jobsFile,filename=None):
+    if filename is None:
+      filename=self.getManifestFilename()
+    with open(filename+'.tmp','w') as f:
+      f.write('{"name":"'+self.name+'",')
+      f.write('"dirs":'+json.dumps(self.getDirTimes(),separators=(',',':'),sort_keys=True)+',')
+      f.write('"jobs":[\n')
+      for ii,job in enumerate(itertools.chain(self.existingJobs,self._iterJsonJobs(jobsFile))):
+        if ii>0:
+          f.write(',\n')
+        job=collections.OrderedDict([('name',job['name']),('phase',job['phase']),('tags',job['tags'])])
+        f.write(json.dumps(job,separators=(',',':')))
+      f.write('\n]}')
+    os.rename(filename+'.tmp',filename)
+
+  # load the jobs already in this workflow, from the local manifest if it
+  # exists, else from swif, to continue job and phase numbering from them:
+  def loadExistingJobs(self,manifest=None):
+    if manifest is None:
+      manifest=self.getManifestFilename()
+    if os.path.exists(manifest):
+      _LOGGER.info('Loading existing jobs from '+manifest)
+      with open(manifest,'r') as f:
+        data=json.load(f)
+      jobs=data['jobs']
+      self.setDirTimes(data.get('dirs',{}))
+    else:
+      _LOGGER.info('Loading existing jobs from swif workflow '+self.name)
+      status=SwifStatus(self.name)
+      status.loadDetails()
+      jobs=status.details.get('jobs',[])
+    self.existingJobs=[]
+    for job in jobs:
+      name=job.get('name',job.get('job_name'))
+      phase=job.get('phase')
+      tags=job.get('tags') or {}
+      self.existingJobs.append({'name':name,'phase':phase,'tags':tags})
+      try:
+        self.jobOffset=max(self.jobOffset,int(name.rsplit('-',1)[1]))
+      except (AttributeError,IndexError,ValueError):
+        pass
+      if phase is not None:
+        self.phaseOffset=max(self.phaseOffset,int(phase))
+    _LOGGER.info('Found %d existing jobs, continuing from job %d and phase %d.'%\
+        (len(self.existingJobs),self.jobOffset,self.phaseOffset))
+    return self.existingJobs
+
   def setPhaseSize(self,phaseSize):
     self.setGroupSize(phaseSize)
 
+  def setPhaseBytes(self,phaseBytes):
+    self.setGroupBytes(phaseBytes)
+
   def getJobs(self,phase):
     jobs=[]
     for job in self.jobs:
@@ -29,23 +122,267 @@ class SwifWorkflow(RunFileGroups):
   def getShell(self):
     return '\n'.join([job.getShell() for job in self.jobs])
 
-  def getJson(self):
-    json  = '{"name":"'+self.name+'","jobs":[\n'
-    json += ',\n'.join([job.getJson() for job in self.jobs])
-    json += '\n]}'
-    return json
+  def getJson(self,compact=False):
+    out=StringIO.StringIO()
+    self.writeJson(out,compact=compact)
+    return out.getvalue()
 
-  def submitShell(self):
-    for job in self.jobs:
-      print(subprocess.check_output(job.getShell().split()))
+  # write the workflow's JSON to a file object, one job at a time:
+  def writeJson(self,out,jobs=None,compact=False):
+    if jobs is None:
+      jobs=self.jobs
+    out.write('{"name":"'+self.name+'","jobs":[\n')
+    for ii,job in enumerate(jobs):
+      if ii>0:
+        out.write(',\n')
+      out.write(job.getJson(compact))
+    out.write('\n]}')
+
+  # write the workflow's JSON to a file, gzipped if it ends in .gz, via a
+  # temporary file so a failure never leaves a partial one in its place:
+  def saveJson(self,filename,jobs=None,compact=False):
+    raw=open(filename+'.tmp','wb')
+    out=raw
+    if filename.endswith('.gz'):
+      # named for the final file in the gzip header:
+      out=gzip.GzipFile(filename,'wb',fileobj=raw)
+    try:
+      with raw:
+        with out:
+          self.writeJson(out,jobs,compact)
+    except:
+      os.remove(filename+'.tmp')
+      raise
+    os.rename(filename+'.tmp',filename)
+
+  # names of the jobs swif already has, or None if unknown (e.g. the
+  # workflow doesn't exist yet):
+  def _getJobNames(self):
+    status=SwifStatus(self.name)
+    try:
+      status.loadDetails()
+    except (subprocess.CalledProcessError,OSError,ValueError) as e:
+      _LOGGER.warning('Cannot get job names from swif:  %s'%str(e))
+      return None
+    return set([job.get('job_name',job.get('name')) for job in status.details.get('jobs',[])])
+
+  # run one job's swif add-job, returning whether it succeeded:
+  def _addJob(self,job):
+    try:
+      subprocess.check_output(job.getShellArgs(),stderr=subprocess.STDOUT)
+      return True
+    except (subprocess.CalledProcessError,OSError) as e:
+      _LOGGER.warning('Failed adding %s:  %s'%(job.getJobName(),str(e)))
+      return False
+
+  # add jobs concurrently, retrying failures with exponential backoff.  A
+  # failed add-job (e.g. a timeout) may still have added the job, so swif
+  # is asked once per retry which are already there, to not add them
+  # twice.  Returns the number of jobs that failed:
+  def _addJobs(self,pool,jobs,retries,backoff):
+    for attempt in range(retries+1):
+      if attempt>0:
+        _LOGGER.warning('Retrying %d jobs in %.1f s ...'%(len(jobs),backoff*2**(attempt-1)))
+        time.sleep(backoff*2**(attempt-1))
+        names=self._getJobNames()
+        if names is not None:
+          for job in [x for x in jobs if x.getJobName() in names]:
+            _LOGGER.info('Found %s already in swif, not retrying.'%job.getJobName())
+          jobs=[x for x in jobs if x.getJobName() not in names]
+          if len(jobs)==0:
+            break
+      results=pool.map(self._addJob,jobs,1)
+      jobs=[job for job,result in zip(jobs,results) if not result]
+      if len(jobs)==0:
+        break
+    for job in jobs:
+      _LOGGER.error('Failed adding %s after %d retries.'%(job.getJobName(),retries))
+    return len(jobs)
+
+  # add jobs (default self.jobs) one swif add-job at a time, with up to
+  # threads concurrent, logging throughput.  Returns whether all succeeded.
+  def submitShell(self,jobs=None,threads=1,retries=3,backoff=2.0):
+    if jobs is None:
+      jobs=self.jobs
+    jobs=iter(jobs)
+    start=time.time()
+    nJobs,nFailed=0,0
+    pool=ThreadPool(max(1,threads))
+    try:
+      # the first job creates the workflow, so do that alone:
+      for job in jobs:
+        nJobs+=1
+        if self._addJobs(pool,[job],retries,backoff)>0:
+          return False
+        break
+      # in batches, to not pull a lazy job generator all into memory:
+      while True:
+        batch=list(itertools.islice(jobs,100*max(1,threads)))
+        if len(batch)==0:
+          break
+        nJobs+=len(batch)
+        nFailed+=self._addJobs(pool,batch,retries,backoff)
+        _LOGGER.info('Added %d jobs at %.1f jobs/s'%(nJobs,nJobs/(time.time()-start)))
+    finally:
+      pool.close()
+      pool.join()
+    _LOGGER.info('Added %d jobs in %.1f s at %.1f jobs/s, %d failed.'%\
+        (nJobs-nFailed,time.time()-start,nJobs/max(time.time()-start,1e-6),nFailed))
+    if nFailed>0:
+      return False
+    print(subprocess.check_output(['swif','run','-workflow',self.name]))
+    print(subprocess.check_output(['swif','status','-workflow',self.name]))
+    return True
+
+  # import from the given JSON file, else a temporary one from self.jobs:
+  def submitJson(self,filename=None):
+    if filename is None or filename.endswith('.gz'):
+      with tempfile.NamedTemporaryFile(suffix='.json') as jsonFile:
+        if filename is None:
+          self.writeJson(jsonFile,compact=True)
+        else:
+          with gzip.open(filename,'rb') as gzFile:
+            shutil.copyfileobj(gzFile,jsonFile)
+        jsonFile.flush()
+        print(subprocess.check_output(['swif','import','-file',jsonFile.name]))
+    else:
+      print(subprocess.check_output(['swif','import','-file',filename]))
+    print(subprocess.check_output(['swif','run','-workflow',self.name]))
+    print(subprocess.check_output(['swif','status','-workflow',self.name]))
+
+  # names of jobs already imported, one per line in the progress file:
+  def _loadProgress(self,progressFile):
+    names=set()
+    if os.path.exists(progressFile):
+      with open(progressFile,'r') as f:
+        for line in f:
+          if len(line.strip())>0:
+            names.add(line.strip())
+    return names
+
+  # iterate over the jobs in a workflow's JSON file, decoding one at a time
+  # so the whole file is never in memory.  The "jobs" list must be the last
+  # key, as written by writeJson:
+  def _iterJsonJobs(self,filename,blockSize=1<<20):
+    if filename.endswith('.gz'):
+      f=gzip.open(filename,'rb')
+    else:
+      f=open(filename,'r')
+    # plain dicts, since ordered ones are several times slower to decode:
+    decoder=json.JSONDecoder()
+    with f:
+      buf=''
+      while '[' not in buf:
+        block=f.read(blockSize)
+        if len(block)==0:
+          raise ValueError('Missing jobs list in '+filename)
+        buf+=block
+      header,buf=buf.split('[',1)
+      if not header.replace(' ','').endswith('"jobs":'):
+        raise ValueError('Jobs list is not the last key in '+filename)
+      # decode from an index into the buffer, which is only cut on refills:
+      idx,eof=0,False
+      while True:
+        while idx<len(buf) and buf[idx] in ' \t\r\n,':
+          idx+=1
+        job=None
+        if idx<len(buf):
+          if buf[idx]==']':
+            return
+          try:
+            job,idx=decoder.raw_decode(buf,idx)
+          except ValueError:
+            pass
+        if job is not None:
+          yield job
+          continue
+        # an incomplete job, so read more:
+        if eof:
+          raise ValueError('Truncated jobs list in '+filename)
+        block=f.read(blockSize)
+        eof=len(block)==0
+        buf=buf[idx:]+block
+        idx=0
+
+  # split a workflow's JSON file into lists of at most chunkSize jobs, each
+  # from only one phase, skipping jobs whose names are in done:
+  def _getChunks(self,filename,chunkSize,done):
+    chunk=[]
+    for job in self._iterJsonJobs(filename):
+      if job['name'] in done:
+        continue
+      if len(chunk)>=chunkSize or (len(chunk)>0 and chunk[-1]['phase']!=job['phase']):
+        yield chunk
+        chunk=[]
+      chunk.append(job)
+    if len(chunk)>0:
+      yield chunk
+
+  def _importChunk(self,chunk,tmpDir,progressFile,lock):
+    first,last=chunk[0]['name'],chunk[-1]['name']
+    chunkFile='%s/%s.json'%(tmpDir,first)
+    with open(chunkFile,'w') as f:
+      f.write('{"name":"'+self.name+'","jobs":[\n')
+      f.write(',\n'.join([json.dumps(job,separators=(',',':')) for job in chunk]))
+      f.write('\n]}')
+    try:
+      subprocess.check_output(['swif','import','-file',chunkFile],stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError,OSError) as e:
+      _LOGGER.error('Failed importing jobs %s to %s:  %s'%(first,last,str(e)))
+      return False
+    finally:
+      os.remove(chunkFile)
+    with lock:
+      with open(progressFile,'a') as f:
+        f.write('\n'.join([job['name'] for job in chunk])+'\n')
+    _LOGGER.info('Imported %d jobs %s to %s'%(len(chunk),first,last))
+    return True
 
-  def submitJson(self):
-    with tempfile.NamedTemporaryFile() as jsonFile:
-      jsonFile.write(self.getJson())
-      jsonFile.flush()
-      print(subprocess.check_output(['swif','import','-file',jsonFile.name]))
+  # import the given JSON file in chunks of at most chunkSize jobs, with up
+  # to threads concurrent imports.  Imported job names are appended to the
+  # progress file, and jobs already listed there are skipped, so rerunning
+  # after a failure resumes where it stopped.  Returns whether all succeeded.
+  def submitChunks(self,filename,chunkSize,threads=1,progressFile=None):
+    if progressFile is None:
+      progressFile=filename.rsplit('.json',1)[0]+'.progress'
+    done=self._loadProgress(progressFile)
+    if len(done)>0:
+      _LOGGER.info('Resuming from %s with %d jobs already imported.'%(progressFile,len(done)))
+    chunks=self._getChunks(filename,chunkSize,done)
+    threads=max(1,threads)
+    _LOGGER.info('Importing jobs in chunks of %d with %d threads ...'%(chunkSize,threads))
+    tmpDir=tempfile.mkdtemp(prefix=self.name+'-')
+    lock=threading.Lock()
+    results=[]
+    try:
+      # the first import creates the workflow, so do that alone:
+      if len(done)==0:
+        chunk=next(chunks,None)
+        if chunk is not None:
+          if not self._importChunk(chunk,tmpDir,progressFile,lock):
+            return False
+          results.append(True)
+      # then read ahead at most one chunk per thread at a time:
+      pool=ThreadPool(threads)
+      try:
+        while True:
+          batch=list(itertools.islice(chunks,threads))
+          if len(batch)==0:
+            break
+          results.extend(pool.map(lambda x: self._importChunk(x,tmpDir,progressFile,lock),batch,1))
+      finally:
+        pool.close()
+        pool.join()
+    finally:
+      shutil.rmtree(tmpDir,ignore_errors=True)
+    if not all(results):
+      _LOGGER.critical('%d of %d chunks failed, rerun to resume from %s'%\
+          (results.count(False),len(results),progressFile))
+      return False
+    _LOGGER.info('Imported %d chunks.'%len(results))
     print(subprocess.check_output(['swif','run','-workflow',self.name]))
     print(subprocess.check_output(['swif','status','-workflow',self.name]))
+    return True
 
 if __name__ == '__main__':
   name = 'myWorkflow'
@@ -0,0 +1,179 @@
+import os,stat,sqlite3,logging
+
+import RunFileUtil
+import MssStub
+
+_LOGGER=logging.getLogger(__name__)
+
+#
+# Persistent, SQLite-backed catalog of input files.
+#
+# Each directory is stored with its mtime and list of subdirectories, and
+# each file with its run/file numbers, size, and mtime.  A directory is
+# only relisted if its mtime changed since the last scan, else its contents
+# are read from the catalog.  Adding/removing entries in a directory changes
+# its mtime, so an unchanged directory's cached subdirectory list is still
+# valid, and walking a previously scanned tree costs one stat per directory.
+#
+class FileCatalog:
+
+  _SCHEMA=[
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, val TEXT)',
+    'CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT)',
+    'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, name TEXT, run INTEGER, file INTEGER, size INTEGER, mtime REAL)',
+    'CREATE INDEX IF NOT EXISTS files_dir ON files (dir)',
+    'CREATE TABLE IF NOT EXISTS stubs (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, volser TEXT, position INTEGER, valid INTEGER)',
+  ]
+
+  def __init__(self,filename):
+    self.filename=filename
+    self.hits=0
+    self.misses=0
+    _LOGGER.info('Opening file catalog at '+filename)
+    self.db=sqlite3.connect(filename)
+    self.db.text_factory=str
+    for sql in FileCatalog._SCHEMA:
+      self.db.execute(sql)
+    self._checkRegex()
+    self._loadDirs()
+
+  # run/file numbers are only valid for the regex they were parsed with:
+  def _checkRegex(self):
+    regex=RunFileUtil.getFileRegex()
+    row=self.db.execute('SELECT val FROM meta WHERE key=?',('fileRegex',)).fetchone()
+    if row is not None and row[0]!=regex:
+      _LOGGER.warning('File regex changed, clearing catalog '+self.filename)
+      self.clear()
+    self.db.execute('INSERT OR REPLACE INTO meta VALUES (?,?)',('fileRegex',regex))
+    self.db.commit()
+
+  def clear(self):
+    self.db.execute('DELETE FROM dirs')
+    self.db.execute('DELETE FROM files')
+    self.db.execute('DELETE FROM stubs')
+    self.db.commit()
+    self.dirs={}
+
+  def close(self):
+    self.db.commit()
+    self.db.close()
+
+  def _loadDirs(self):
+    self.dirs={}
+    for path,mtime,subdirs in self.db.execute('SELECT path,mtime,subdirs FROM dirs'):
+      if len(subdirs)>0:
+        self.dirs[path]=(mtime,subdirs.split('/'))
+      else:
+        self.dirs[path]=(mtime,[])
+
+  # filesystem access only, safe to call from multiple threads:
+  def _scanDir(self,path):
+    subdirs,files=[],[]
+    for name in sorted(os.listdir(path)):
+      fullname=path+'/'+name
+      try:
+        st=os.stat(fullname)
+        if stat.S_ISDIR(st.st_mode):
+          # like os.walk, do not follow symlinks to directories:
+          if not os.path.islink(fullname):
+            subdirs.append(name)
+          continue
+      except OSError:
+        _LOGGER.warning('Cannot stat '+fullname)
+        continue
+      rf=RunFileUtil.getRunFileNumber(fullname)
+      if rf is None:
+        files.append((name,None,None,st.st_size,st.st_mtime))
+      else:
+        files.append((name,rf['run'],rf['file'],st.st_size,st.st_mtime))
+    return subdirs,files
+
+  # return subdirectories, and scanned files or None if the cache is valid:
+  def _lister(self,path):
+    key=os.path.normpath(path)
+    mtime=os.stat(path).st_mtime
+    if key in self.dirs and self.dirs[key][0]==mtime:
+      return list(self.dirs[key][1]),(key,mtime,None)
+    subdirs,files=self._scanDir(path)
+    return subdirs,(key,mtime,files)
+
+  def _store(self,key,mtime,subdirs,files):
+    self.db.execute('DELETE FROM files WHERE dir=?',(key,))
+    self.db.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)',
+        [(key+'/'+f[0],key)+f for f in files])
+    self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?,?,?)',(key,mtime,'/'.join(subdirs)))
+    self.dirs[key]=(mtime,list(subdirs))
+
+  def _getFiles(self,key):
+    return self.db.execute('SELECT name,run,file,size,mtime FROM files WHERE dir=? ORDER BY name',(key,)).fetchall()
+
+  # return lists of subdirectory names and (name,run,file,size,mtime) tuples:
+  def listDir(self,path):
+    subdirs,(key,mtime,files)=self._lister(path)
+    if files is None:
+      self.hits+=1
+      return subdirs,self._getFiles(key)
+    self.misses+=1
+    _LOGGER.debug('Scanned directory '+path)
+    self._store(key,mtime,subdirs,files)
+    return subdirs,files
+
+  # like os.walk, but yields (dirpath,dirnames,files) with files from listDir,
+  # see RunFileUtil.walk for the ordering and threading:
+  def walk(self,tops,threads=1):
+    for dirpath,dirnames,(key,mtime,files) in RunFileUtil.walk(tops,self._lister,threads):
+      if files is None:
+        self.hits+=1
+        files=self._getFiles(key)
+      else:
+        self.misses+=1
+        self._store(key,mtime,dirnames,files)
+      yield dirpath,dirnames,files
+    self.db.commit()
+    _LOGGER.info('File catalog used %d cached and %d rescanned directories.'%(self.hits,self.misses))
+
+  # /mss stub contents, reread only if the file's mtime changed since it was
+  # cataloged (or since it was statted, if it's not in the catalog):
+  def getStub(self,path):
+    key=os.path.normpath(path)
+    row=self.db.execute('SELECT mtime FROM files WHERE path=?',(key,)).fetchone()
+    try:
+      if row is None:
+        mtime=os.stat(path).st_mtime
+      else:
+        mtime=row[0]
+    except OSError:
+      return None
+    row=self.db.execute('SELECT mtime,size,volser,position,valid FROM stubs WHERE path=?',(key,)).fetchone()
+    if row is not None and row[0]==mtime:
+      if not row[4]:
+        return None
+      return {'size':row[1],'volser':row[2],'position':row[3]}
+    stub=MssStub.readStub(path)
+    if stub is None:
+      self.db.execute('INSERT OR REPLACE INTO stubs VALUES (?,?,?,?,?,?)',(key,mtime,None,None,None,0))
+    else:
+      self.db.execute('INSERT OR REPLACE INTO stubs VALUES (?,?,?,?,?,?)',(key,mtime,stub['size'],stub['volser'],stub['position'],1))
+    return stub
+
+  def getStubs(self,paths):
+    stubs=dict([(path,self.getStub(path)) for path in paths])
+    self.db.commit()
+    return stubs
+
+  def getSize(self,path):
+    row=self.db.execute('SELECT size FROM files WHERE path=?',(os.path.normpath(path),)).fetchone()
+    if row is None:
+      return None
+    return row[0]
+
+if __name__ == '__main__':
+  import sys
+  logging.basicConfig(level=logging.INFO)
+  if len(sys.argv)<3:
+    sys.exit('usage:  python FileCatalog.py catalog.sqlite dir [dir [...]]')
+  catalog=FileCatalog(sys.argv[1])
+  for top in sys.argv[2:]:
+    for dirpath,dirnames,files in catalog.walk(top):
+      print('%s %d'%(dirpath,len(files)))
+  catalog.close()
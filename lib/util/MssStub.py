@@ -0,0 +1,63 @@
+import os,logging
+
+_LOGGER=logging.getLogger(__name__)
+
+#
+# Files in /mss are small text stubs describing the file on tape, with one
+# key=value per line, e.g.:
+#
+#   bitfileid=123456789
+#   size=1999974400
+#   volser=700123
+#   filePosition=2047
+#
+# readStub returns a dict with 'size', 'volser' and 'position' (any of which
+# may be None), or None if the file is not a stub.
+#
+
+_MAXSTUBSIZE=4096
+
+_KEYS={
+  'size'         : 'size',
+  'volser'       : 'volser',
+  'filePosition' : 'position',
+  'fileposition' : 'position',
+  'position'     : 'position',
+}
+
+_INTKEYS=['size','position']
+
+def readStub(fileName):
+  try:
+    if os.path.getsize(fileName)>_MAXSTUBSIZE:
+      return None
+    with open(fileName,'r') as f:
+      lines=f.readlines()
+  except (IOError,OSError):
+    _LOGGER.warning('Cannot read stub '+fileName)
+    return None
+  stub={'size':None,'volser':None,'position':None}
+  for line in lines:
+    if line.find('=')<0:
+      continue
+    key,val=line.strip().split('=',1)
+    key=key.strip()
+    if key not in _KEYS:
+      continue
+    key=_KEYS[key]
+    val=val.strip()
+    if key in _INTKEYS:
+      try:
+        val=int(val)
+      except ValueError:
+        _LOGGER.warning('Invalid %s in stub %s: %s'%(key,fileName,val))
+        continue
+    stub[key]=val
+  if stub['size'] is None and stub['volser'] is None:
+    return None
+  return stub
+
+if __name__ == '__main__':
+  import sys
+  for fileName in sys.argv[1:]:
+    print('%s %s'%(fileName,str(readStub(fileName))))
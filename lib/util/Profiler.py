@@ -0,0 +1,83 @@
+import time,logging,functools,contextlib,collections
+
+_LOGGER=logging.getLogger(__name__)
+
+#
+# Wall time and call counts for named stages and wrapped functions, logged
+# as a summary table, plus an optional cProfile dump.  When disabled,
+# nothing is wrapped and stage() is a no-op.
+#
+class Profiler:
+
+  def __init__(self,enabled=False,dumpFile=None):
+    self.enabled=enabled or dumpFile is not None
+    self.dumpFile=dumpFile
+    # name -> [seconds,calls], in order of first use:
+    self.stats=collections.OrderedDict()
+    self.cprofile=None
+    if dumpFile is not None:
+      import cProfile
+      self.cprofile=cProfile.Profile()
+      self.cprofile.enable()
+
+  def add(self,name,seconds,calls=1):
+    if name not in self.stats:
+      self.stats[name]=[0.0,0]
+    self.stats[name][0]+=seconds
+    self.stats[name][1]+=calls
+
+  @contextlib.contextmanager
+  def stage(self,name):
+    if not self.enabled:
+      yield
+      return
+    t=time.time()
+    try:
+      yield
+    finally:
+      self.add(name,time.time()-t)
+
+  # replace obj.attr (a module's function or a class's method) with a
+  # timed and counted version:
+  def wrap(self,obj,attr,name=None):
+    if not self.enabled:
+      return
+    if name is None:
+      name='%s.%s'%(getattr(obj,'__name__',str(obj)),attr)
+    func=getattr(obj,attr)
+    # unwrap class methods, so the wrapper binds like the original:
+    func=getattr(func,'__func__',func)
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+      t=time.time()
+      try:
+        return func(*args,**kwargs)
+      finally:
+        self.add(name,time.time()-t)
+    setattr(obj,attr,wrapper)
+
+  def getSummary(self):
+    lines=['%-30s %10s %10s'%('STAGE/FUNCTION','SECONDS','CALLS')]
+    for name,(seconds,calls) in self.stats.items():
+      lines.append('%-30s %10.3f %10d'%(name,seconds,calls))
+    return '\n'.join(lines)
+
+  # log the summary, and write the cProfile dump:
+  def finish(self):
+    if not self.enabled:
+      return
+    if self.cprofile is not None:
+      self.cprofile.disable()
+      self.cprofile.dump_stats(self.dumpFile)
+      _LOGGER.info('Wrote cProfile stats to '+self.dumpFile)
+    for line in self.getSummary().split('\n'):
+      _LOGGER.info(line)
+
+if __name__ == '__main__':
+  logging.basicConfig(level=logging.INFO)
+  p=Profiler(True)
+  p.wrap(time,'sleep')
+  with p.stage('sleeping'):
+    for ii in range(3):
+      time.sleep(0.1)
+  p.finish()
@@ -1,41 +1,195 @@
-import os,re,glob,logging,collections
+import os,re,glob,time,bisect,logging,collections
+from multiprocessing.pool import ThreadPool
+import MssStub
+
+# os.scandir requires python>=3.5, else try the scandir module:
+try:
+  from os import scandir
+except ImportError:
+  try:
+    from scandir import scandir
+  except ImportError:
+    scandir=None
 
 # The first/second group must match the run/file number:
 __FILEREGEX='.*clas[_A-Za-z]*_(\d+)\.evio\.(\d+)'
 
+# Directories whose names match this contain a single run, the first group
+# must match the run number (e.g. clas_004013 for raw data, 004013 for decoded):
+__DIRREGEX='^(?:clas[_A-Za-z]*_)?(\d{6})$'
+
+_FILEPATTERN=re.compile(__FILEREGEX)
+_DIRPATTERN=re.compile(__DIRREGEX)
+
+# Parsed run/file numbers, keyed on filename, in two generations:  when
+# the current one is full it becomes the old one, and old entries move back
+# to the current one when used again, so recently used names are never all
+# dropped at once.  iterGroups also adds each group's names, from its
+# already parsed RunFiles, before generation reparses them:
+_PARSED={}
+_PARSEDOLD={}
+_PARSEDMAX=100000
+_MISSING=object()
+
 _LOGGER=logging.getLogger(__name__)
 
 def setFileRegex(regex):
-  global __FILEREGEX
+  global __FILEREGEX,_FILEPATTERN
   _LOGGER.info('Changing file regex to '+regex+'. Checking for compilation ...')
-  re.compile(regex)
+  _FILEPATTERN=re.compile(regex)
   __FILEREGEX=regex
+  clearParsed()
 
 def getFileRegex():
   return __FILEREGEX
 
+# immutable (run,file) numbers, also subscriptable by name, e.g. rf['run']:
+class RunFileNumber(collections.namedtuple('RunFileNumber',['run','file'])):
+  __slots__=()
+  def __getitem__(self,key):
+    if isinstance(key,basestring):
+      return getattr(self,key)
+    return tuple.__getitem__(self,key)
+
+# skips the namedtuple's python-level __new__, for speed:
+_newRunFileNumber=tuple.__new__
+
+def clearParsed():
+  _PARSED.clear()
+  _PARSEDOLD.clear()
+
+def setParsed(fileName,rf):
+  global _PARSED,_PARSEDOLD
+  if len(_PARSED)>=_PARSEDMAX:
+    _PARSED,_PARSEDOLD=_PARSEDOLD,_PARSED
+    _PARSED.clear()
+  _PARSED[fileName]=rf
+
 def getRunFileNumber(fileName):
-  mm = re.match(__FILEREGEX,fileName)
+  if fileName in _PARSED:
+    return _PARSED[fileName]
+  rf=_PARSEDOLD.get(fileName,_MISSING)
+  if rf is _MISSING:
+    mm = _FILEPATTERN.match(fileName)
+    if mm is None:
+      _LOGGER.debug('Failed to find run number in:  '+fileName)
+      rf=None
+    else:
+      rf=_newRunFileNumber(RunFileNumber,(int(mm.group(1)),int(mm.group(2))))
+  setParsed(fileName,rf)
+  return rf
+
+def getRunFileNumbers(fileNames):
+  return [getRunFileNumber(fileName) for fileName in fileNames]
+
+def getRunDirNumber(dirName):
+  mm = _DIRPATTERN.match(dirName)
   if mm is None:
-    _LOGGER.debug('Failed to find run number in:  '+fileName)
     return None
-  runno=int(mm.group(1))
-  fileno=int(mm.group(2))
-  return {'run':runno,'file':fileno}
+  return int(mm.group(1))
+
+# return sorted lists of subdirectory and file names, like os.walk
+# this does not follow symlinks to directories:
+def listDir(path):
+  dirnames,filenames=[],[]
+  if scandir is None:
+    for name in os.listdir(path):
+      fullname=os.path.join(path,name)
+      if os.path.isdir(fullname):
+        if not os.path.islink(fullname):
+          dirnames.append(name)
+      else:
+        filenames.append(name)
+  else:
+    for entry in scandir(path):
+      if entry.is_dir():
+        if not entry.is_symlink():
+          dirnames.append(entry.name)
+      else:
+        filenames.append(entry.name)
+  dirnames.sort()
+  filenames.sort()
+  return dirnames,filenames
+
+def _timedLister(lister):
+  def timed(path):
+    t=time.time()
+    try:
+      result=lister(path)
+    except OSError:
+      _LOGGER.warning('Cannot list directory '+path)
+      result=[],None
+    return result,time.time()-t
+  return timed
+
+#
+# walk:  like os.walk (top-down), yielding (dirpath,dirnames,result) with
+# (dirnames,result)=lister(dirpath), for each of the tops.  Each level of
+# directories is listed concurrently with the given number of threads, since
+# listing is dominated by filesystem metadata latency, not CPU.  The order is
+# deterministic (breadth-first, sorted), and dirnames can be modified in place
+# to prune the walk.
+#
+def walk(tops,lister=listDir,threads=1):
+  if not isinstance(tops,list):
+    tops=[tops]
+  pool=None
+  if threads>1:
+    pool=ThreadPool(threads)
+  timed=_timedLister(lister)
+  ndirs,tsum,tslow,slowest=0,0,0,None
+  t=time.time()
+  try:
+    level=list(tops)
+    while len(level)>0:
+      if pool is None:
+        results=[timed(path) for path in level]
+      else:
+        results=pool.map(timed,level)
+      nextLevel=[]
+      for dirpath,((dirnames,result),dt) in zip(level,results):
+        _LOGGER.debug('Listed %s in %.3f s'%(dirpath,dt))
+        ndirs,tsum=ndirs+1,tsum+dt
+        if dt>=tslow:
+          tslow,slowest=dt,dirpath
+        if result is None:
+          continue
+        yield dirpath,dirnames,result
+        nextLevel.extend([os.path.join(dirpath,dirname) for dirname in dirnames])
+      level=nextLevel
+  finally:
+    if pool is not None:
+      pool.close()
+  if ndirs>0:
+    _LOGGER.info('Listed %d directories with %d threads in %.1f s (%.3f s/directory, slowest %.3f s for %s)'%\
+        (ndirs,threads,time.time()-t,tsum/ndirs,tslow,slowest))
 
-class RunFile:
+# shared directory strings, to avoid a copy of the path prefix per file:
+_DIRNAMES={}
+
+class RunFile(object):
+  __slots__=('dirName','baseName','runNumber','fileNumber')
   def __init__(self,fileName):
-    self.fileName=None
     self.runNumber=None
     self.fileNumber=None
     if isinstance(fileName,unicode):
       fileName=str(fileName)
     fileName=fileName.strip()
     rf=getRunFileNumber(fileName)
-    self.fileName=fileName
+    self.dirName=None
+    self.baseName=fileName
+    ii=fileName.rfind('/')
+    if ii>=0:
+      self.dirName=_DIRNAMES.setdefault(fileName[:ii],fileName[:ii])
+      self.baseName=fileName[ii+1:]
     if not rf is None:
       self.fileNumber=rf['file']
       self.runNumber=rf['run']
+  @property
+  def fileName(self):
+    if self.dirName is None:
+      return self.baseName
+    return self.dirName+'/'+self.baseName
   def __eq__(self,other):
     if not type(other) is type(self): raise TypeError('')
     if self.runNumber != other.runNumber: return False
@@ -65,6 +219,10 @@ class RunFileGroup():
   def __init__(self):
     self.runNumber=None
     self.runFileList=[]
+    # sorted file numbers, parallel to runFileList, for bisection:
+    self.fileNumbers=[]
+    # for duplicate detection:
+    self.fileNumberSet=set()
   def size(self):
     return len(self.runFileList)
   def add(self,rf):
@@ -74,20 +232,20 @@ class RunFileGroup():
       return
     elif self.runNumber is None:
       self.runNumber = rf.runNumber
-      self.runFileList.append(rf)
     elif self.runNumber != rf.runNumber:
       raise ValueError('multiple run nubmers ',rf.runNumber)
-    elif rf in self.runFileList:
+    # all files share the run number, so the file number is a unique key:
+    if rf.fileNumber in self.fileNumberSet:
       raise ValueError('duplicate: ',str(rf))
+    self.fileNumberSet.add(rf.fileNumber)
+    # files usually arrive in order, so try appending first:
+    if len(self.fileNumbers)==0 or rf.fileNumber>self.fileNumbers[-1]:
+      self.fileNumbers.append(rf.fileNumber)
+      self.runFileList.append(rf)
     else:
-      inserted=False
-      for ii in range(len(self.runFileList)):
-        if rf < self.runFileList[ii]:
-          self.runFileList.insert(ii,rf)
-          inserted=True
-          break
-      if not inserted:
-        self.runFileList.append(rf)
+      ii=bisect.bisect_right(self.fileNumbers,rf.fileNumber)
+      self.fileNumbers.insert(ii,rf.fileNumber)
+      self.runFileList.insert(ii,rf)
   def addFile(self,fileName):
     self.add(RunFile(fileName))
   def __str__(self):
@@ -104,12 +262,88 @@ class RunFileGroups:
   def __init__(self):
     self.combineRuns=False
     self.groupSize=0
+    self.groupBytes=0
+    self.mergeSize=1
+    self.tapeOrder=False
+    self.catalog=None
+    self.pruneDirs=True
+    self.threads=1
+    # (run,file) pairs to ignore:
+    self.excludes=set()
+    # mtimes of run directories, keyed on path, from a previous listing
+    # (to skip those unchanged since) and from this one, of those listed
+    # without subdirectories:
+    self.oldDirTimes={}
+    self.dirTimes={}
+    self.dirTimesPending={}
     # maintain user's run insertion order:
     self.rfgs=collections.OrderedDict()
 
   def setCombineRuns(self,val):
     self.combineRuns=val
 
+  def setCatalog(self,catalog):
+    self.catalog=catalog
+
+  def setPruneDirs(self,val):
+    self.pruneDirs=val
+
+  def setThreads(self,threads):
+    self.threads=int(threads)
+
+  # ignore files with these (run,file) numbers when adding files:
+  def setExcludes(self,runFiles):
+    self.excludes=set(runFiles)
+
+  # skip run directories whose mtimes, keyed on path, are unchanged from
+  # these, since no files have been added to them (or removed) since:
+  def setDirTimes(self,dirTimes):
+    self.oldDirTimes=dict(dirTimes)
+
+  # run directory mtimes from a previous listing, updated from this one:
+  def getDirTimes(self):
+    dirTimes=dict(self.oldDirTimes)
+    dirTimes.update(self.dirTimes)
+    return dirTimes
+
+  # whether a run directory is unchanged since the previous listing, else
+  # note its mtime, taken before listing it, for recording after:
+  def _isUnchanged(self,path):
+    try:
+      mtime=os.stat(path).st_mtime
+    except OSError:
+      return False
+    if self.oldDirTimes.get(path)==mtime:
+      return True
+    # too recent to know whether files are still arriving in the same tick:
+    if mtime<time.time()-60:
+      self.dirTimesPending[path]=mtime
+    return False
+
+  # record a listed run directory's mtime, if it has no subdirectories:
+  def _listedDir(self,dirpath,dirnames):
+    dirpath=os.path.abspath(dirpath)
+    mtime=self.dirTimesPending.pop(dirpath,None)
+    if mtime is not None and len(dirnames)==0:
+      self.dirTimes[dirpath]=mtime
+
+  # whether a directory belongs to an unregistered run, or is a run
+  # directory unchanged since the previous listing:
+  def _isPruned(self,dirname,dirpath=None):
+    if self.pruneDirs and len(self.rfgs)>0:
+      run=getRunDirNumber(dirname)
+      if run is None:
+        return False
+      if run not in self.rfgs:
+        return True
+      if dirpath is not None:
+        return self._isUnchanged(os.path.abspath(os.path.join(dirpath,dirname)))
+    return False
+
+  # remove pruned subdirectories of dirpath, in place:
+  def _pruneDirs(self,dirpath,dirnames):
+    dirnames[:]=[x for x in dirnames if not self._isPruned(x,dirpath)]
+
   def hasRun(self,run):
     return run in self.rfgs
 
@@ -125,29 +359,70 @@ class RunFileGroups:
   def setGroupSize(self,groupSize):
     self.groupSize=int(groupSize)
 
+  def setGroupBytes(self,groupBytes):
+    self.groupBytes=int(groupBytes)
+
+  # number of consecutive files, per run, never split across groups:
+  def setMergeSize(self,mergeSize):
+    self.mergeSize=max(1,int(mergeSize))
+
+  def setTapeOrder(self,val):
+    self.tapeOrder=val
+
   def addFile(self,fileName):
-    rf=RunFile(fileName)
-    # ignore if run# is not registered:
-    if rf is None or not rf.runNumber in self.rfgs:
+    # ignore if run# is not registered or excluded, before fully parsing:
+    rf=getRunFileNumber(fileName.strip())
+    if rf is None or not rf.run in self.rfgs:
+      return
+    if rf in self.excludes:
       return
-    self.rfgs[rf.runNumber].addFile(fileName)
+    self.rfgs[rf.run].add(RunFile(fileName))
 
   def addDir(self,dirName):
-    _LOGGER.info('Adding directory '+dirName+' ...')
-    for dirpath,dirnames,filenames in os.walk(dirName):
-      for filename in filenames:
-        self.addFile(dirpath+'/'+filename)
+    self.addDirs([dirName])
 
+  def addDirs(self,dirNames):
+    tops=[]
+    for dirName in dirNames:
+      parent,name=os.path.split(os.path.normpath(dirName))
+      if not self._isPruned(name,parent):
+        tops.append(dirName)
+    dirNames=tops
+    if len(dirNames)==0:
+      return
+    for dirName in dirNames:
+      _LOGGER.info('Adding directory '+dirName+' ...')
+    if self.catalog is None:
+      for dirpath,dirnames,filenames in walk(dirNames,threads=self.threads):
+        self._listedDir(dirpath,dirnames)
+        self._pruneDirs(dirpath,dirnames)
+        for filename in filenames:
+          self.addFile(dirpath+'/'+filename)
+    else:
+      for dirpath,dirnames,files in self.catalog.walk(dirNames,threads=self.threads):
+        self._listedDir(dirpath,dirnames)
+        self._pruneDirs(dirpath,dirnames)
+        for name,run,fileno,size,mtime in files:
+          if run in self.rfgs and (run,fileno) not in self.excludes:
+            self.addFile(dirpath+'/'+name)
+
+  # directories are collected and walked together at the end,
+  # so that they can all be listed concurrently:
   def findFiles(self,data):
+    dirs=[]
+    self._findFiles(data,dirs)
+    self.addDirs(dirs)
+
+  def _findFiles(self,data,dirs):
 
     # recurse if it's a list:
     if isinstance(data,list):
       for datum in data:
-        self.findFiles(datum)
+        self._findFiles(datum,dirs)
 
     # walk if it's a directory:
     elif os.path.isdir(data):
-      self.addDir(data)
+      dirs.append(data)
 
     # file containing a file list if it's a file:
     elif os.path.isfile(data):
@@ -157,32 +432,166 @@ class RunFileGroups:
     # else assume it's a glob:
     else:
       _LOGGER.warning('Assuming '+data+' is a glob.')
-      for xx in glob.glob(data):
+      for xx in sorted(glob.glob(data)):
         if os.path.isdir(xx):
-          self.addDir(xx)
+          dirs.append(xx)
         elif os.path.isfile(xx):
           self.addFile(xx)
 
+  # return a dictionary of /mss stubs (or None), keyed on filename:
+  def getStubs(self,fileNames):
+    if self.catalog is not None:
+      return self.catalog.getStubs(fileNames)
+    return dict([(fileName,MssStub.readStub(fileName)) for fileName in fileNames])
+
+  # return a dictionary of file sizes in bytes, keyed on filename, from the
+  # /mss stubs, else the file catalog, else the filesystem:
+  def getSizes(self,fileNames):
+    sizes={}
+    stubs=self.getStubs(fileNames)
+    for fileName in fileNames:
+      if stubs[fileName] is not None and stubs[fileName]['size'] is not None:
+        sizes[fileName]=stubs[fileName]['size']
+        continue
+      if self.catalog is not None:
+        sizes[fileName]=self.catalog.getSize(fileName)
+        if sizes[fileName] is not None:
+          continue
+      try:
+        sizes[fileName]=os.path.getsize(fileName)
+      except OSError:
+        _LOGGER.warning('Cannot get size of '+fileName)
+        sizes[fileName]=0
+    return sizes
+
+  # split a run's files into units that are never split across groups:
+  def _getUnits(self,rfg):
+    n=self.mergeSize
+    return [rfg.runFileList[ii:ii+n] for ii in range(0,rfg.size(),n)]
+
+  # the unit's most common tape volume and its first position there (or
+  # sorted last if it has no tape information), and all its volumes:
+  def _getTapeKey(self,unit,stubs):
+    volumes={}
+    for rf in unit:
+      stub=stubs[rf.fileName]
+      if stub is None or stub['volser'] is None:
+        continue
+      position=stub['position']
+      if position is None:
+        position=-1
+      if stub['volser'] not in volumes:
+        volumes[stub['volser']]=[0,position]
+      volumes[stub['volser']][0]+=1
+      volumes[stub['volser']][1]=min(volumes[stub['volser']][1],position)
+    if len(volumes)==0:
+      return (1,'',0),frozenset()
+    volser=sorted(volumes.keys(),key=lambda x:(-volumes[x][0],x))[0]
+    return (0,volser,volumes[volser][1]),frozenset(volumes.keys())
+
+  # tape keys and volumes of units, keyed on id(unit), with each stub
+  # read only once:
+  def _getTapeInfo(self,units):
+    stubs=self.getStubs([rf.fileName for unit in units for rf in unit])
+    return dict([(id(unit),self._getTapeKey(unit,stubs)) for unit in units])
+
+  def _fits(self,nfiles,nbytes,unit,unitBytes):
+    if nfiles==0:
+      return True
+    if self.groupSize>0 and nfiles+len(unit)>self.groupSize:
+      return False
+    if self.groupBytes>0 and nbytes+unitBytes>self.groupBytes:
+      return False
+    return True
+
+  def _getUnitBytes(self,unit,sizes):
+    return sum([sizes.get(rf.fileName,0) for rf in unit])
+
+  # split units into groups in order, within the size limits:
+  def _splitUnits(self,units,sizes):
+    group,nfiles,nbytes=[],0,0
+    for unit in units:
+      unitBytes=self._getUnitBytes(unit,sizes)
+      if not self._fits(nfiles,nbytes,unit,unitBytes):
+        yield group
+        group,nfiles,nbytes=[],0,0
+      group.append(unit)
+      nfiles,nbytes=nfiles+len(unit),nbytes+unitBytes
+    if len(group)>0:
+      yield group
+
+  # pack units into groups within the size limits, so that each group
+  # reads as few tape volumes as possible, and each sequentially.  Units
+  # are blocked by their main volume, in position order.  Each block fills
+  # whole groups, and the blocks' leftovers are packed together (first fit,
+  # largest first) so that no block is split across groups needlessly:
+  def _packUnits(self,units,sizes,tape):
+    blocks=collections.OrderedDict()
+    for unit in sorted(units,key=lambda x:tape[id(x)][0]):
+      blocks.setdefault(tape[id(unit)][0][:2],[]).append(unit)
+    groups,leftovers=[],[]
+    for block in blocks.values():
+      split=list(self._splitUnits(block,sizes))
+      groups.extend(split[:-1])
+      leftovers.append(split[-1])
+    bins=[]
+    for leftover in sorted(leftovers,key=lambda x:-sum([len(unit) for unit in x])):
+      nfiles=sum([len(unit) for unit in leftover])
+      nbytes=sum([self._getUnitBytes(unit,sizes) for unit in leftover])
+      for b in bins:
+        if self._fits(b[1],b[2],[None]*nfiles,nbytes):
+          b[0].extend(leftover)
+          b[1],b[2]=b[1]+nfiles,b[2]+nbytes
+          break
+      else:
+        bins.append([list(leftover),nfiles,nbytes])
+    groups.extend([b[0] for b in bins])
+    # read the volumes in order:
+    groups.sort(key=lambda x:tape[id(x[0])][0])
+    # a short (last) unit goes last in its group, to keep the others'
+    # merges aligned:
+    for group in groups:
+      group.sort(key=lambda x:len(x)<self.mergeSize)
+    return groups
+
   def getGroups(self):
-    groups=[]
-    phaseList=[]
+    return list(self.iterGroups())
+
+  # generate the groups one at a time, so only one is in memory:
+  def iterGroups(self):
+    unitLists=[]
+    if self.combineRuns:
+      unitLists.append([])
     for run,rfg in self.rfgs.iteritems():
-      # make a new group unless we're allowed to combine runs:
-      if not self.combineRuns:
-        if len(phaseList)>0:
-          groups.append(phaseList)
+      if self.combineRuns:
+        unitLists[0].extend(self._getUnits(rfg))
+      else:
+        unitLists.append(self._getUnits(rfg))
+    sizes={}
+    if self.groupBytes>0:
+      sizes=self.getSizes(self.getFlatList())
+    ngroups,nvolumes=0,0
+    for units in unitLists:
+      if self.tapeOrder:
+        tape=self._getTapeInfo(units)
+        groups=self._packUnits(units,sizes,tape)
+      else:
+        groups=self._splitUnits(units,sizes)
+      for group in groups:
         phaseList=[]
-      # loop over the files in this run:
-      for rf in rfg.runFileList:
-        phaseList.append(rf.fileName)
-        # make a new group if we're over the size limit:
-        if self.groupSize>0 and len(phaseList)>=self.groupSize:
-          groups.append(phaseList)
-          phaseList=[]
-    # make a new group for any leftovers:
-    if len(phaseList)>0:
-      groups.append(phaseList)
-    return groups
+        for unit in group:
+          for rf in unit:
+            phaseList.append(rf.fileName)
+            setParsed(phaseList[-1],_newRunFileNumber(RunFileNumber,(rf.runNumber,rf.fileNumber)))
+        if self.tapeOrder:
+          volumes=set()
+          for unit in group:
+            volumes.update(tape[id(unit)][1])
+          ngroups,nvolumes=ngroups+1,nvolumes+len(volumes)
+          _LOGGER.debug('Group with %d files reads %d tape volumes:  %s'%(len(phaseList),len(volumes),','.join(sorted(volumes))))
+        yield phaseList
+    if ngroups>0:
+      _LOGGER.info('Tape ordering:  %d groups read %.1f tape volumes on average.'%(ngroups,float(nvolumes)/ngroups))
 
   def getFlatList(self):
     flatList=[]
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
-import sys,os,logging
+import sys,os,time,atexit,logging
+t0=time.time()
 from ChefConfig import ChefConfig
+from Profiler import Profiler
 
 #logging.basicConfig(level=logging.INFO,format='%(levelname)-9s[%(name)-14s %(lineno).3d] %(message)s')
 logging.basicConfig(level=logging.INFO,format='%(levelname)-9s[%(name)-14s] %(message)s')
@@ -8,23 +10,66 @@ logger=logging.getLogger(__name__)
 
 print('')
 cc=ChefConfig(sys.argv[1:])
-workflow=cc.getWorkflow()
 
-logger.info('Generating workflow ...')
-workflow.generate()
+profiler=Profiler(cc.get('profile'),cc.get('profileDump'))
+if profiler.enabled:
+  import ChefUtil,RcdbManager,RunFileUtil,SwifWorkflow,SwifJob,CLAS12Workflow
+  profiler.add('config',time.time()-t0)
+  profiler.wrap(ChefUtil,'mkdir','ChefUtil.mkdir')
+  profiler.wrap(RcdbManager.RcdbManager,'get','RcdbManager.get')
+  profiler.wrap(RcdbManager.RcdbManager,'prefetch','RcdbManager.prefetch')
+  profiler.wrap(RunFileUtil.RunFileGroups,'findFiles','RunFileGroups.findFiles')
+  for xx in ['decode','merge','move','delete','reconclara']:
+    profiler.wrap(CLAS12Workflow.CLAS12Workflow,xx,'CLAS12Workflow.'+xx)
+  profiler.wrap(SwifJob.SwifJob,'getJson','SwifJob.getJson')
+  profiler.wrap(SwifWorkflow.SwifWorkflow,'saveManifest','SwifWorkflow.saveManifest')
+  # also log the summary if exiting early:
+  atexit.register(profiler.finish)
 
-logger.info('Created workflow with %d jobs based on %d runs with %d total input files.'%\
-    (len(workflow.jobs),len(workflow.getRunList(1)),workflow.getFileCount()))
+with profiler.stage('getWorkflow'):
+  workflow=cc.getWorkflow()
+
+# the manifest only includes jobs already submitted, so this (and the
+# chunked submission's progress file) stays the same when rerun after
+# a failed submission:
+filename=workflow.name
+if cc.get('append') is not None:
+  filename+='_append%.5d'%(workflow.jobOffset+1)
+filename+='.json'
+if cc.get('gzip'):
+  filename+='.gz'
 
-if os.path.exists(workflow.name+'.json'):
-  logger.critical('File already exists:  '+workflow.name+'.json')
+# a chunked submission can be resumed from the existing file:
+if os.path.exists(filename):
+  if cc.get('submit') and cc.get('submitChunk')>0:
+    logger.info('Resuming submission of existing '+filename+' ...')
+    if not workflow.submitChunks(filename,cc.get('submitChunk'),cc.get('submitThreads')):
+      sys.exit(1)
+    workflow.saveManifest(filename)
+    sys.exit()
+  logger.critical('File already exists:  '+filename)
   sys.exit()
 
-logger.info('Writing workflow to ./'+workflow.name+'.json ...')
-with open(workflow.name+'.json','w') as out:
-  out.write(workflow.getJson())
+# jobs are generated and written one phase at a time:
+logger.info('Generating workflow and writing to ./'+filename+' ...')
+with profiler.stage('generate+saveJson'):
+  workflow.saveJson(filename,workflow.iterJobs(),compact=cc.get('compact'))
+
+logger.info('Created workflow with %d jobs based on %d runs with %d total input files.'%\
+    (workflow.getJobCount(),len(workflow.getRunList(1)),workflow.getFileCount()))
 
 if cc.get('submit'):
-  logger.info('Submitting %s.json with %d jobs ...'%(workflow.name,len(workflow.jobs)))
-  workflow.submitJson()
+  logger.info('Submitting %s with %d jobs ...'%(filename,workflow.getJobCount()))
+  with profiler.stage('submit'):
+    if cc.get('submitShell'):
+      # jobs are not kept in memory, so generate them again:
+      if not workflow.submitShell(workflow.iterJobs(),cc.get('submitThreads')):
+        sys.exit(1)
+    elif cc.get('submitChunk')>0:
+      if not workflow.submitChunks(filename,cc.get('submitChunk'),cc.get('submitThreads')):
+        sys.exit(1)
+    else:
+      workflow.submitJson(filename)
 
+# for later appends, once its jobs are submitted (or left for the user to):
+workflow.saveManifest(filename)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+import os,sys,json,logging,argparse,datetime
+logging.basicConfig(level=logging.INFO,format='%(levelname)-9s[%(name)-15s] %(message)s')
+from ResourceModel import ResourceModel
+
+cli=argparse.ArgumentParser(description='Fit a resource table for clas12-workflow.py --resourceTable from job history.',
+    epilog='Recon time per event is fitted from CLARA logs, RAM per job mode from the SLURM archive.  Wall times in the SLURM archive include queue time, so are not used.')
+cli.add_argument('-o',metavar='PATH',help='output resource table',type=str,required=True)
+cli.add_argument('-i',metavar='PATH',help='input resource table to start from (default=built-in)',type=str,default=None)
+cli.add_argument('-c',metavar='PATH',help='CLARA log file or directory (repeatable)',type=str,default=[],action='append')
+cli.add_argument('-w',metavar='PATH',help='workflow manifest, mapping job names to modes (repeatable)',type=str,default=[],action='append')
+cli.add_argument('-u',metavar='user',help='SLURM archive username (repeatable)',type=str,default=[],action='append')
+cli.add_argument('-d',metavar='#',help='number of days of SLURM archive (default=%(default)s)',type=int,default=7)
+args=cli.parse_args(sys.argv[1:])
+
+if len(args.u)>0 and len(args.w)==0:
+  cli.error('-u requires at least one workflow manifest (-w).')
+
+rm=ResourceModel(args.i)
+
+if len(args.c)>0:
+  from ClaraLog import ClaraLog
+  logs=[]
+  for path in args.c:
+    if os.path.isdir(path):
+      for d,x,files in os.walk(path):
+        for f in files:
+          if f.endswith('orch.log') or f.endswith('.out'):
+            logs.append(ClaraLog(d+'/'+f))
+    else:
+      logs.append(ClaraLog(path))
+  rm.fitRecon(logs)
+
+if len(args.u)>0:
+  from SlurmStatus import SlurmQuery
+  modes={}
+  for manifest in args.w:
+    with open(manifest,'r') as f:
+      for job in json.load(f)['jobs']:
+        modes[job['name']]=(job.get('tags') or {}).get('mode')
+  statuses=[]
+  for user in args.u:
+    sq=SlurmQuery(user)
+    sq.setDayDelta(args.d)
+    sq.get()
+    statuses.extend(sq.myData)
+  rm.fitRam(statuses,modes)
+
+rm.save(args.o)
+print('Wrote resource table to '+args.o)
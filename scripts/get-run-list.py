@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import sys
 from RunFileUtil import RunFileGroups
-from RcdbManager import RcdbManager
+from RcdbManager import RcdbManager,DEFAULTCACHE
 
 runStart = int(sys.argv[1])
 runEnd = int(sys.argv[2])
@@ -19,21 +19,19 @@ for fileName in open(fileList,'r').readlines():
   print fileName
   rfgs.addFile(fileName)
 
-rcdb = RcdbManager()
+rcdb = RcdbManager(cache=DEFAULTCACHE,threads=8)
 
 for run,rfg in rfgs.rfgs.iteritems():
   if rfg.size()>10:
     print run,rfg.size()
 
 print 'checking rcdb ...'
+runs=rfgs.getRunList(10)
+failed=rcdb.prefetch(runs)
 missing=[]
-for run in rfgs.getRunList(10):
-  try:
-    t=rcdb.getTorusScale(run)
-    s=rcdb.getSolenoidScale(run)
-    r=rcdb.getRunStartTime(run)
-  except AttributeError:
+for run in runs:
+  if rcdb.getTorusScale(run) is None or rcdb.getSolenoidScale(run) is None:
     missing.append(run)
 print missing
-
-
+if len(failed)>0:
+  print 'failed queries:',failed
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+import re,sys,time,random,argparse,multiprocessing
+import RunFileUtil
+from RunFileUtil import RunFile,RunFileGroups
+
+cli=argparse.ArgumentParser(description='Benchmark RunFileUtil on synthetic filenames.')
+cli.add_argument('-n',metavar='#',help='number of files (default=%(default)s)',type=int,default=1000000)
+cli.add_argument('-r',metavar='#',help='number of runs (default=%(default)s)',type=int,default=100)
+cli.add_argument('-s',metavar='#',help='random seed (default=%(default)s)',type=int,default=0)
+cli.add_argument('--shuffle',help='add files in random order',action='store_true',default=False)
+cli.add_argument('--parse',help='benchmark filename parsing',action='store_true',default=False)
+cli.add_argument('--memory',help='compare memory usage of old and new RunFile',action='store_true',default=False)
+args=cli.parse_args(sys.argv[1:])
+
+def getFileNames(nfiles,nruns,shuffle):
+  fileNames=[]
+  for ii in range(nfiles):
+    run=4000+ii%nruns
+    fileNames.append('/mss/clas12/rg-a/data/clas_%.6d/clas_%.6d.evio.%.5d'%(run,run,ii/nruns))
+  if shuffle:
+    random.shuffle(fileNames)
+  return fileNames
+
+# the original RunFile, with a __dict__ and a full path per file:
+class LegacyRunFile:
+  def __init__(self,fileName):
+    self.fileName=fileName.strip()
+    self.runNumber=None
+    self.fileNumber=None
+    rf=RunFileUtil.getRunFileNumber(self.fileName)
+    if rf is not None:
+      self.fileNumber=rf['file']
+      self.runNumber=rf['run']
+
+def getRss():
+  with open('/proc/self/status','r') as f:
+    for line in f.readlines():
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1])*1024
+  return 0
+
+# measure in a forked process, so neither form sees the other's heap:
+def measureRss(cls,fileNames,queue):
+  rss=getRss()
+  runFiles=[cls(fileName) for fileName in fileNames]
+  queue.put(getRss()-rss)
+
+def memoryReport(fileNames):
+  for cls in [LegacyRunFile,RunFile]:
+    queue=multiprocessing.Queue()
+    proc=multiprocessing.Process(target=measureRss,args=(cls,fileNames,queue))
+    proc.start()
+    rss=queue.get()
+    proc.join()
+    print('%-14s %8.1f MB  %6.1f bytes/file'%(cls.__name__,rss/1e6,float(rss)/len(fileNames)))
+
+def timeParse(fileNames):
+  # the original, uncompiled and uncached:
+  t=time.time()
+  for fileName in fileNames:
+    mm=re.match(RunFileUtil.getFileRegex(),fileName)
+    rf={'run':int(mm.group(1)),'file':int(mm.group(2))}
+  yield 're.match',time.time()-t
+  RunFileUtil.clearParsed()
+  t=time.time()
+  RunFileUtil.getRunFileNumbers(fileNames)
+  yield 'getRunFileNumbers',time.time()-t
+  # repeated lookups, like during job generation:
+  t=time.time()
+  for fileName in fileNames:
+    RunFileUtil.getRunFileNumber(fileName)
+    RunFileUtil.getRunFileNumber(fileName)
+  yield 'getRunFileNumber x2',time.time()-t
+
+def timeAdd(fileNames,nruns):
+  rfgs=RunFileGroups()
+  rfgs.addRuns(range(4000,4000+nruns))
+  t=time.time()
+  for fileName in fileNames:
+    rfgs.addFile(fileName)
+  t=time.time()-t
+  if rfgs.getFileCount()!=len(fileNames):
+    sys.exit('ERROR:  added %d of %d files'%(rfgs.getFileCount(),len(fileNames)))
+  return t
+
+random.seed(args.s)
+fileNames=getFileNames(args.n,args.r,args.shuffle)
+if args.memory:
+  memoryReport(fileNames)
+  sys.exit()
+if args.parse:
+  for name,t in timeParse(fileNames[:RunFileUtil._PARSEDMAX]):
+    print('%-20s %.3f s  %.0f files/s'%(name,t,min(args.n,RunFileUtil._PARSEDMAX)/t))
+  sys.exit()
+t=timeAdd(fileNames,args.r)
+print('RunFileGroups.addFile:  %d files, %d runs, %.2f s, %.0f files/s'%(args.n,args.r,t,args.n/t))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import os,sys,json,time,shutil,logging,resource,tempfile,argparse,multiprocessing
+logging.basicConfig(level=logging.WARNING)
+import ChefUtil
+import CLAS12Jobs
+from ChefConfig import ChefConfig,Models
+
+cli=argparse.ArgumentParser(description='Benchmark workflow generation on synthetic file lists.')
+cli.add_argument('-n',metavar='#,#,...',help='numbers of files (default=%(default)s)',type=str,default='1000,10000,100000')
+cli.add_argument('-r',metavar='#',help='number of runs (default=%(default)s)',type=int,default=100)
+cli.add_argument('-m',metavar='#,#,...',help='models (default=%(default)s)',type=str,default='0,1,2,4')
+cli.add_argument('-p',metavar='PATH,...',help='generation paths, lazy (iterJobs+saveJson to a file, as in clas12-workflow.py) and/or eager (generate+writeJson) (default=%(default)s)',type=str,default='lazy,eager')
+cli.add_argument('-o',metavar='PATH',help='write results as JSON to PATH',type=str,default=None)
+cli.add_argument('--phaseSize',metavar='#',help='files per phase (default=%(default)s)',type=int,default=1000)
+cli.add_argument('--mergeSize',metavar='#',help='files per merge (default=%(default)s)',type=int,default=10)
+args=cli.parse_args(sys.argv[1:])
+
+args.p=args.p.split(',')
+for path in args.p:
+  if path not in ['lazy','eager']:
+    cli.error('Invalid generation path:  '+path)
+
+# a catalog of nfiles evio (or decoded hipo) files, spread over nruns runs:
+def writeFileList(filename,nfiles,nruns,hipo):
+  with open(filename,'w') as f:
+    for ii in range(nfiles):
+      run=4000+ii%nruns
+      name='/mss/clas12/rg-a/data/clas_%.6d/clas_%.6d.evio.%.5d'%(run,run,ii/nruns)
+      if hipo:
+        name=name.replace('/mss/','/cache/')+'.hipo'
+      f.write(name+'\n')
+
+# stand-ins for a coatjava and clara install, which ChefConfig requires:
+def makeInstalls(tmpDir):
+  for xx in ['coatjava','clara']:
+    os.makedirs(tmpDir+'/'+xx)
+  open(tmpDir+'/recon.yaml','w').close()
+
+def getCliArgs(tmpDir,model,fileList,nruns):
+  cliArgs=['--runGroup','test','--tag','bench','--model',str(model),
+      '--runs','4000-%d'%(4000+nruns-1),'--inputs',fileList,
+      '--outDir',tmpDir+'/out','--logDir',tmpDir+'/log',
+      '--torus','-1.0','--solenoid','1.0',
+      '--phaseSize',str(args.phaseSize),'--mergeSize',str(args.mergeSize)]
+  if Models.Coatjava[model]:
+    cliArgs.extend(['--coatjava',tmpDir+'/coatjava'])
+  if Models.Clara[model]:
+    cliArgs.extend(['--clara',tmpDir+'/clara','--reconYaml',tmpDir+'/recon.yaml'])
+  if model not in [Models.SinglesDecoding,Models.ClaraRecon]:
+    cliArgs.extend(['--workDir',tmpDir+'/work'])
+  return cliArgs
+
+# discards the JSON, just counting its size:
+class CountingSink:
+  def __init__(self):
+    self.bytes=0
+  def write(self,data):
+    self.bytes+=len(data)
+
+def getPeakRss():
+  # kilobytes on linux:
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+# run all stages in a forked process, for an independent peak RSS.  The
+# lazy path generates and writes one phase at a time, so they are timed
+# together:
+def measure(cliArgs,path,jsonFile,queue):
+  result={'stages':{}}
+  # no filesystem or RCDB side effects:
+  mkdirs=[]
+  ChefUtil.mkdir=lambda path: mkdirs.append(path)
+  CLAS12Jobs._RCDB.get=lambda run: {'solenoid_scale':1.0,'torus_scale':-1.0,'run_start_time':None}
+  try:
+    t=time.time()
+    cc=ChefConfig(cliArgs)
+    result['stages']['config']=time.time()-t
+    t=time.time()
+    workflow=cc.getWorkflow()
+    result['stages']['workflow']=time.time()-t
+    if path=='lazy':
+      t=time.time()
+      workflow.saveJson(jsonFile,workflow.iterJobs())
+      result['stages']['generate+json']=time.time()-t
+      result['jsonBytes']=os.path.getsize(jsonFile)
+      os.remove(jsonFile)
+    else:
+      t=time.time()
+      workflow.generate()
+      result['stages']['generate']=time.time()-t
+      t=time.time()
+      sink=CountingSink()
+      workflow.writeJson(sink)
+      result['stages']['json']=time.time()-t
+      result['jsonBytes']=sink.bytes
+    result['jobs']=workflow.getJobCount()
+    result['mkdirs']=len(mkdirs)
+  except (Exception,SystemExit) as e:
+    result['error']=repr(e)
+  result['peakRss']=getPeakRss()
+  queue.put(result)
+
+results=[]
+tmpDir=tempfile.mkdtemp(prefix='workflow-benchmark-')
+try:
+  makeInstalls(tmpDir)
+  print('%5s %5s %8s %8s %8s %8s %8s %8s %8s %10s %9s'%\
+      ('model','path','files','jobs','config','workflow','generate','json','total','JSON MB','RSS MB'))
+  for nfiles in [int(x) for x in args.n.split(',')]:
+    for hipo in [False,True]:
+      writeFileList('%s/files%d.txt'%(tmpDir,hipo),nfiles,args.r,hipo)
+    for model in [int(x) for x in args.m.split(',')]:
+      fileList='%s/files%d.txt'%(tmpDir,model==Models.ClaraRecon)
+      for path in args.p:
+        queue=multiprocessing.Queue()
+        proc=multiprocessing.Process(target=measure,args=(getCliArgs(tmpDir,model,fileList,args.r),path,tmpDir+'/workflow.json',queue))
+        proc.start()
+        result=queue.get()
+        proc.join()
+        result.update({'model':model,'path':path,'files':nfiles,'runs':args.r})
+        results.append(result)
+        if 'error' in result:
+          print('%5d %5s %8d  ERROR:  %s'%(model,path,nfiles,result['error']))
+          continue
+        stages=result['stages']
+        if path=='lazy':
+          generate,writeJson='%8.2f'%stages['generate+json'],'%8s'%'-'
+        else:
+          generate,writeJson='%8.2f'%stages['generate'],'%8.2f'%stages['json']
+        print('%5d %5s %8d %8d %8.2f %8.2f %s %s %8.2f %10.1f %9.1f'%(model,path,nfiles,result['jobs'],
+            stages['config'],stages['workflow'],generate,writeJson,sum(stages.values()),
+            result['jsonBytes']/1e6,result['peakRss']/1e6))
+finally:
+  shutil.rmtree(tmpDir,ignore_errors=True)
+
+if args.o is not None:
+  with open(args.o,'w') as f:
+    f.write(json.dumps(results,indent=2,separators=(',',': '),sort_keys=True))
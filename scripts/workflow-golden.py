@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import os,sys,copy,json,difflib,argparse,tempfile,shutil
+import ChefUtil
+import CLAS12Workflows
+from ChefConfig import CFG,Models
+
+# generated paths that depend on where this repository is checked out:
+_ROOT=os.path.normpath(os.path.dirname(os.path.realpath(__file__))+'/..')
+
+cli=argparse.ArgumentParser(description='Check generated workflows against golden files, and the lazy, streamed JSON against the whole workflow in one dump.')
+cli.add_argument('-d',metavar='PATH',help='golden file directory (default=%(default)s)',type=str,default=_ROOT+'/scripts/golden')
+cli.add_argument('-w',help='write the golden files instead of checking them',action='store_true',default=False)
+args=cli.parse_args(sys.argv[1:])
+
+_WORKFLOWS={
+  Models.ThreePhaseDecoding : CLAS12Workflows.ThreePhaseDecoding,
+  Models.RollingDecoding    : CLAS12Workflows.RollingDecoding,
+  Models.SinglesDecoding    : CLAS12Workflows.SinglesOnlyDecoding,
+  Models.ClaraRecon         : CLAS12Workflows.ClaraSingles,
+}
+
+# 3 runs of 24 files, so phases and merges have leftovers:
+def writeFileList(filename,hipo):
+  with open(filename,'w') as f:
+    for run in [4013,4014,4015]:
+      for ii in range(24):
+        name='/mss/clas12/rg-a/data/clas_%.6d/clas_%.6d.evio.%.5d'%(run,run,ii)
+        if hipo:
+          name='/cache/clas12/rg-a/decoded/%.6d/clas_%.6d.evio.%.5d.hipo'%(run,run,ii)
+        f.write(name+'\n')
+
+def getConfig(model,fileList):
+  cfg=copy.deepcopy(CFG)
+  cfg.update({'runGroup':'rga','tag':'golden','model':model,'task':Models.Tasks[model],
+    'runs':[4013,4014,4015],'inputs':[fileList],'outDir':'/golden/out','logDir':'/golden/log',
+    'torus':-1.0,'solenoid':1.0,'phaseSize':20,'mergeSize':10,'rcdbCache':None})
+  if Models.Coatjava[model]:
+    cfg['coatjava']='/golden/coatjava'
+  if Models.Clara[model]:
+    cfg.update({'clara':'/golden/clara','reconYaml':'/golden/recon.yaml','claraLogDir':'/golden/clara-log'})
+  if model not in [Models.SinglesDecoding,Models.ClaraRecon]:
+    cfg['workDir']='/golden/work'
+  return cfg
+
+def getWorkflow(model,fileList):
+  cfg=getConfig(model,fileList)
+  name='%s-%s-%s_R%dx%d'%(cfg['runGroup'],cfg['task'],cfg['tag'],cfg['runs'][0],len(cfg['runs']))
+  return _WORKFLOWS[model](name,cfg)
+
+# the production path, jobs generated one phase at a time and streamed:
+def getLazyJson(model,fileList,tmpDir):
+  workflow=getWorkflow(model,fileList)
+  filename=tmpDir+'/lazy.json'
+  workflow.saveJson(filename,workflow.iterJobs())
+  with open(filename,'r') as f:
+    return f.read().replace(_ROOT,'$ROOT')
+
+# all jobs generated first, and serialized in one dump:
+def getEagerData(model,fileList):
+  workflow=getWorkflow(model,fileList)
+  workflow.generate()
+  data={'name':workflow.name,'jobs':[job.getJsonData() for job in workflow.jobs]}
+  return json.loads(json.dumps(data).replace(_ROOT,'$ROOT'))
+
+# no filesystem side effects:
+ChefUtil.mkdir=lambda path: None
+
+failed=False
+tmpDir=tempfile.mkdtemp(prefix='workflow-golden-')
+try:
+  for hipo in [False,True]:
+    writeFileList('%s/files%d.txt'%(tmpDir,hipo),hipo)
+  if args.w and not os.path.isdir(args.d):
+    os.makedirs(args.d)
+  for model in sorted(_WORKFLOWS.keys()):
+    fileList='%s/files%d.txt'%(tmpDir,model==Models.ClaraRecon)
+    golden='%s/model%d.json'%(args.d,model)
+    lazy=getLazyJson(model,fileList,tmpDir)
+    if json.loads(lazy)!=getEagerData(model,fileList):
+      print('model %d:  FAILED, streamed JSON differs from one dump'%model)
+      failed=True
+    if args.w:
+      with open(golden,'w') as f:
+        f.write(lazy)
+      print('model %d:  wrote %s'%(model,golden))
+      continue
+    with open(golden,'r') as f:
+      expected=f.read()
+    if lazy==expected:
+      print('model %d:  OK, %d jobs'%(model,len(json.loads(lazy)['jobs'])))
+    else:
+      print('model %d:  FAILED, differs from %s:'%(model,golden))
+      diff=difflib.unified_diff(expected.split('\n'),lazy.split('\n'),golden,'generated',lineterm='')
+      for line in list(diff)[:40]:
+        print(line)
+      failed=True
+finally:
+  shutil.rmtree(tmpDir,ignore_errors=True)
+
+if failed:
+  sys.exit(1)